@@ -0,0 +1,130 @@
+import struct
+import time
+import array
+import micropython
+
+# IMA-ADPCM (WAV format tag 0x11), mono, 256 byte blocks
+BLOCK_ALIGN = 256
+SAMPLES_PER_BLOCK = (BLOCK_ALIGN - 4) * 2 + 1   # 505
+HEADER_SIZE = 60
+
+_STEPS = array.array('H', (
+    7, 8, 9, 10, 11, 12, 13, 14, 16, 17, 19, 21, 23, 25, 28, 31, 34, 37, 41, 45,
+    50, 55, 60, 66, 73, 80, 88, 97, 107, 118, 130, 143, 157, 173, 190, 209, 230,
+    253, 279, 307, 337, 371, 408, 449, 494, 544, 598, 658, 724, 796, 876, 963,
+    1060, 1166, 1282, 1411, 1552, 1707, 1878, 2066, 2272, 2499, 2749, 3024, 3327,
+    3660, 4026, 4428, 4871, 5358, 5894, 6484, 7132, 7845, 8630, 9493, 10442,
+    11487, 12635, 13899, 15289, 16818, 18500, 20350, 22385, 24623, 27086, 29794,
+    32767))
+
+@micropython.viper
+def _encode_block(src, dst, state):
+    # src: SAMPLES_PER_BLOCK int16, dst: BLOCK_ALIGN bytes, state: [step index]
+    s = ptr16(src)
+    d = ptr8(dst)
+    st = ptr32(state)
+    steps = ptr16(_STEPS)
+    idx = st[0]
+    pred = s[0]
+    if pred > 32767: pred -= 65536
+    d[0] = pred & 0xFF
+    d[1] = (pred >> 8) & 0xFF
+    d[2] = idx
+    d[3] = 0
+    i = 1
+    while i < 505:
+        sample = s[i]
+        if sample > 32767: sample -= 65536
+        step = steps[idx]
+        diff = sample - pred
+        code = 0
+        if diff < 0:
+            code = 8
+            diff = 0 - diff
+        delta = step >> 3
+        if diff >= step:
+            code |= 4; diff -= step; delta += step
+        step >>= 1
+        if diff >= step:
+            code |= 2; diff -= step; delta += step
+        step >>= 1
+        if diff >= step:
+            code |= 1; delta += step
+        if code & 8: pred -= delta
+        else: pred += delta
+        if pred > 32767: pred = 32767
+        elif pred < -32768: pred = -32768
+        if code & 4: idx += ((code & 3) << 1) + 2
+        else: idx -= 1
+        if idx < 0: idx = 0
+        elif idx > 88: idx = 88
+        o = 4 + ((i - 1) >> 1)
+        if i & 1: d[o] = code
+        else: d[o] = d[o] | (code << 4)
+        i += 1
+    st[0] = idx
+
+def encoded_size(num_samples):
+    return ((num_samples + SAMPLES_PER_BLOCK - 1) // SAMPLES_PER_BLOCK) * BLOCK_ALIGN
+
+def create_header(num_samples, sample_rate):
+    data_size = encoded_size(num_samples)
+    byte_rate = sample_rate * BLOCK_ALIGN // SAMPLES_PER_BLOCK
+    return struct.pack('<4sI4s4sIHHIIHHHH4sII4sI', b'RIFF', HEADER_SIZE - 8 + data_size, b'WAVE',
+                       b'fmt ', 20, 0x11, 1, sample_rate, byte_rate, BLOCK_ALIGN, 4, 2, SAMPLES_PER_BLOCK,
+                       b'fact', 4, num_samples, b'data', data_size)
+
+class Encoder:
+    # Incremental: feed() any amount of PCM, full blocks go to emit(memoryview)
+    def __init__(self):
+        self.pcm = bytearray(SAMPLES_PER_BLOCK * 2)
+        self.out = bytearray(BLOCK_ALIGN)
+        self.state = array.array('i', (0,))
+        self.fill = 0
+
+    def reset(self):
+        self.state[0] = 0
+        self.fill = 0
+
+    def feed(self, data, emit):
+        mv = memoryview(data)
+        l, off = len(mv), 0
+        while l > 0:
+            amt = min(l, len(self.pcm) - self.fill)
+            self.pcm[self.fill : self.fill+amt] = mv[off : off+amt]
+            self.fill += amt
+            off += amt
+            l -= amt
+            if self.fill == len(self.pcm):
+                _encode_block(self.pcm, self.out, self.state)
+                emit(self.out)
+                self.fill = 0
+
+    def flush(self, emit):
+        # Pad the last block with silence; the fact chunk holds the real length
+        if self.fill == 0: return
+        for i in range(self.fill, len(self.pcm)): self.pcm[i] = 0
+        _encode_block(self.pcm, self.out, self.state)
+        emit(self.out)
+        self.fill = 0
+
+def benchmark(seconds=1, sample_rate=16000):
+    pcm = bytearray(sample_rate * 2 * seconds)
+    for i in range(0, len(pcm), 2):  # ~500 Hz sawtooth so every code path runs
+        struct.pack_into('<h', pcm, i, ((i >> 1) % 32) * 1500 - 24000)
+    enc = Encoder()
+    out_bytes = [0]
+    def count(mv): out_bytes[0] += len(mv)
+    t0 = time.ticks_us()
+    enc.feed(pcm, count)
+    enc.flush(count)
+    dt = time.ticks_diff(time.ticks_us(), t0)
+    ratio = len(pcm) / out_bytes[0]
+    print(f"ADPCM: {seconds}s audio encoded in {dt // 1000} ms ({dt // (1000 * seconds)} ms per s), {len(pcm)} -> {out_bytes[0]} bytes ({ratio:.2f}:1)")
+    # BLE path paces 20 byte notifications every 15 ms (send_audio.BLEApp.send)
+    ble_rate = 20 * 1000 // 15
+    print(f"ADPCM: BLE transfer {len(pcm) * 1000 // ble_rate} ms -> {out_bytes[0] * 1000 // ble_rate} ms per {seconds}s")
+    return dt, ratio
+
+if __name__ == "__main__":
+    benchmark()
@@ -1,9 +1,9 @@
 import bluetooth
 import struct
-import time
 import config
 from pyb import LED
 import micropython
+from ble_transfer import BulkSender
 
 micropython.alloc_emergency_exception_buf(100)
 led_green = LED(2)
@@ -14,7 +14,7 @@ class BLEHandler:
         self.ble.active(True)
 
         self.conn_handle = None
-        self.payload_size = 20
+        self.tx = BulkSender(self.ble, config.BLE_MTU)
 
         self.req_image = False
         self.req_audio_rec = False
@@ -52,12 +52,13 @@ class BLEHandler:
     def _irq(self, event, data):
         if event == 1:
             self.conn_handle = data[0]
+            self.tx.connected(self.conn_handle)
             led_green.off()
             print("BLE: Connected")
 
         elif event == 2:
             self.conn_handle = None
-            self.payload_size = 20
+            self.tx.disconnected()
             self._advertise()
             print("BLE: Disconnected")
 
@@ -69,7 +70,7 @@ class BLEHandler:
                 self._handle_cmd(self.h_uart_rx, "uart")
 
         elif event == 21:
-            self.payload_size = data[1] - 3
+            self.tx.mtu_exchanged(data[1])
             print(f"MTU: {data[1]}")
 
     def _handle_cmd(self, handle, type):
@@ -82,18 +83,7 @@ class BLEHandler:
         except: pass
 
     def send_image_packet(self, data):
-        self._send_fast(self.h_img_data, data)
+        return self.tx.send(self.h_img_data, data)
 
     def send_uart_packet(self, data):
-        self._send_fast(self.h_uart_tx, data)
-
-    def _send_fast(self, handle, data):
-        if not self.conn_handle: return
-        try:
-            self.ble.gatts_notify(self.conn_handle, handle, data)
-        except OSError as e:
-            if e.args[0] == 11:
-                time.sleep_ms(10)
-                try:
-                    self.ble.gatts_notify(self.conn_handle, handle, data)
-                except: pass
+        return self.tx.send(self.h_uart_tx, data)
@@ -0,0 +1,83 @@
+import time
+import metrics
+
+DEFAULT_PAYLOAD = 20        # ATT_MTU 23 - 3 until the exchange completes
+PREFERRED_MTU = 247         # Fits one LE data packet with DLE
+NOTIFY_TIMEOUT_MS = 2000    # Give up on a packet the stack refuses this long
+
+class BulkSender:
+    # Shared BLE notify engine: MTU-sized payloads, paced by the stack accepting notifications.
+    # The owner forwards its IRQ events to connected() / disconnected() / mtu_exchanged().
+    def __init__(self, ble, mtu=PREFERRED_MTU):
+        self.ble = ble
+        self.conn = None
+        self.payload_size = DEFAULT_PAYLOAD
+        self.bytes_sent = 0
+        self.stalls = 0
+        self.dropped = 0
+        self.t_start = 0
+        try: ble.config(mtu=mtu)
+        except Exception as e: print(f"BLE: MTU config failed {e}")
+
+    def connected(self, conn):
+        self.conn = conn
+        self.payload_size = DEFAULT_PAYLOAD
+        try: self.ble.gattc_exchange_mtu(conn)
+        except Exception: pass  # Central may start the exchange itself
+
+    def disconnected(self):
+        self.conn = None
+        self.payload_size = DEFAULT_PAYLOAD
+
+    def mtu_exchanged(self, mtu):
+        self.payload_size = mtu - 3
+
+    def begin(self):
+        self.bytes_sent = 0
+        self.stalls = 0
+        self.dropped = 0
+        self.t_start = time.ticks_ms()
+
+    def report(self, tag="BLE"):
+        ms = max(1, time.ticks_diff(time.ticks_ms(), self.t_start))
+        rate = self.bytes_sent * 1000 // ms
+        print(f"{tag}: {self.bytes_sent} bytes in {ms} ms ({rate} B/s, payload {self.payload_size}, stalls {self.stalls}, dropped {self.dropped})")
+        return rate
+
+    def send(self, handle, data):
+        # Split into payload_size notifications; False once the link is gone or a packet times out
+        mv = memoryview(data)
+        total, off = len(mv), 0
+        while off < total:
+            end = min(off + self.payload_size, total)
+            if not self._notify(handle, mv[off:end]): return False
+            off = end
+        return True
+
+    def send_file(self, handle, f, buf=None):
+        # Stream an open file in reads of several payloads each
+        if buf is None: buf = bytearray(self.payload_size * 8)
+        mv = memoryview(buf)
+        while True:
+            n = f.readinto(buf)
+            if not n: return True
+            if not self.send(handle, mv[:n]): return False
+
+    def _notify(self, handle, mv):
+        wait, start = 0, time.ticks_ms()
+        while self.conn is not None:
+            try:
+                self.ble.gatts_notify(self.conn, handle, mv)
+                self.bytes_sent += len(mv)
+                metrics.inc("ble_tx", len(mv))
+                return True
+            except OSError:
+                # Controller TX queue full: back off until it drains instead of a fixed sleep
+                self.stalls += 1
+                metrics.inc("ble_stall")
+                if time.ticks_diff(time.ticks_ms(), start) > NOTIFY_TIMEOUT_MS: break
+                time.sleep_ms(wait)
+                wait = min(wait * 2 or 1, 16)
+        self.dropped += 1
+        metrics.inc("ble_drop")
+        return False
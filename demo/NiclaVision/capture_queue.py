@@ -0,0 +1,54 @@
+import time
+
+# Capture requests (picture, recording, memo) waiting for the camera or the microphone.
+# Served lowest priority value first and in arrival order within a priority, so two quick
+# take_picture commands give two pictures and a RECORD is never lost behind a picture.
+# Bounded, so a client that floods commands cannot run the heap down.
+QUEUE_MAX = 8
+PRIO_AUDIO = 1              # The wearer is waiting to speak
+PRIO_IMAGE = 2
+
+class CaptureRequest:
+    def __init__(self, kind, rid, prio, opts, seq):
+        self.kind = kind        # "img", "aud" or "memo"
+        self.rid = rid          # Request ID echoed on the reply, or None
+        self.prio = prio
+        self.opts = opts        # Kind-specific parameters, read by the job that serves it
+        self.seq = seq
+        self.t = time.ticks_ms()
+        self.xfer = []          # Outbox transfers its job started, withdrawn if it is cancelled
+
+class CaptureQueue:
+    def __init__(self, limit=QUEUE_MAX):
+        self.items = []         # Kept sorted by (prio, seq)
+        self.limit = limit
+        self.seq = 0
+        self.full = 0           # Requests refused because the queue was full
+
+    def push(self, kind, rid, prio, opts=None):
+        # The queued request, or None when the queue is full
+        if len(self.items) >= self.limit:
+            self.full += 1
+            return None
+        self.seq += 1
+        r = CaptureRequest(kind, rid, prio, opts, self.seq)
+        i = len(self.items)
+        while i and self.items[i - 1].prio > prio: i -= 1
+        self.items.insert(i, r)
+        return r
+
+    def pop(self, ready):
+        # First request whose kind ready(kind) accepts; others keep their place
+        for i in range(len(self.items)):
+            if ready(self.items[i].kind): return self.items.pop(i)
+        return None
+
+    def cancel(self, rid=None):
+        # Drop the queued request with this ID, or all of them for None; returns how many
+        n = len(self.items)
+        self.items = [r for r in self.items if rid is not None and r.rid != rid]
+        return n - len(self.items)
+
+    def take_all(self):
+        items, self.items = self.items, []
+        return items
@@ -0,0 +1,63 @@
+import errno
+
+RX_BUF_SIZE = 256
+
+class LineParser:
+    # Incremental newline framing over one preallocated buffer per client.
+    # Partial lines survive across reads; any number of lines can arrive in one read.
+    def __init__(self, size=RX_BUF_SIZE):
+        self.buf = bytearray(size)
+        self.mv = memoryview(self.buf)
+        self.fill = 0
+        self.scanned = 0
+        self.overflow = False   # Current line outgrew the buffer and is being skipped
+
+    def read_from(self, sock):
+        # Bytes read, 0 on EOF, None when nothing is waiting
+        if self.fill == len(self.buf):
+            self.fill = self.scanned = 0
+            self.overflow = True
+        try: n = sock.readinto(self.mv[self.fill:])
+        except OSError as e:
+            if e.args[0] == errno.EAGAIN: return None
+            raise
+        if n: self.fill += n
+        return n
+
+    def next_line(self):
+        # Next complete line as str without the newline, or None
+        buf = self.buf
+        while True:
+            i = self.scanned
+            while i < self.fill and buf[i] != 10: i += 1
+            if i == self.fill:
+                self.scanned = i
+                return None
+            end = i - 1 if i and buf[i - 1] == 13 else i
+            line = None
+            if not self.overflow:
+                try: line = str(self.mv[:end], 'utf-8')
+                except UnicodeError: pass
+            rest = self.fill - i - 1
+            buf[:rest] = self.mv[i + 1:self.fill]
+            self.fill, self.scanned = rest, 0
+            self.overflow = False
+            if line is not None: return line.strip()
+
+def split_id(line):
+    # "take_picture #42" -> ("take_picture", "42"); the ID is echoed in the response
+    k = line.rfind(" #")
+    if k < 0: return line, None
+    return line[:k].strip(), line[k + 2:]
+
+def split_prio(cmd, default):
+    # "take_picture !0" -> ("take_picture", 0); lower values are served first
+    k = cmd.rfind(" !")
+    if k < 0: return cmd, default
+    try: return cmd[:k].strip(), int(cmd[k + 2:])
+    except ValueError: return cmd, default
+
+def tag(text, rid):
+    # Append " #<id>" to a reply line that ends in a newline
+    if not rid: return text
+    return text[:-1] + " #" + rid + "\n"
@@ -10,6 +10,8 @@ UART_SERVICE_UUID = bluetooth.UUID("6E400001-B5A3-F393-E0A9-E50E24DCCA9E")
 UART_TX_UUID      = bluetooth.UUID("6E400003-B5A3-F393-E0A9-E50E24DCCA9E")
 UART_RX_UUID      = bluetooth.UUID("6E400002-B5A3-F393-E0A9-E50E24DCCA9E")
 
+BLE_MTU = 247
+
 # --- AUDIO SETTINGS ---
 REC_SECONDS = 3.5
 SAMPLE_RATE = 16000
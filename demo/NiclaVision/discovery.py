@@ -0,0 +1,61 @@
+import socket
+import select
+import time
+import json
+import machine
+import binascii
+
+BEACON_MS = 2000
+BROADCAST_IP = "255.255.255.255"
+
+class Discovery:
+    # One long-lived UDP socket on the discovery port. It broadcasts the legacy
+    # NICLA_READY plus a JSON beacon, and answers NICLA_DISCOVER[:<id>] queries
+    # right away with the beacon sent straight back to the asking socket.
+    def __init__(self, port, tcp_port, fw_version, caps):
+        self.port = port
+        self.device_id = binascii.hexlify(machine.unique_id()).decode()
+        self.id_bytes = self.device_id.encode()  # Queries are matched as bytes, never decoded
+        self.beacon = json.dumps({"type": "nicla", "id": self.device_id, "fw": fw_version,
+                                  "caps": caps, "port": tcp_port}).encode()
+        self.sock = None
+        self.poller = None
+        self.last_beacon = 0
+
+    def open(self):
+        if self.sock: return
+        self.sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+        try: self.sock.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+        except: pass
+        self.sock.bind(('', self.port))
+        self.sock.setblocking(False)
+        self.poller = select.poll()
+        self.poller.register(self.sock, select.POLLIN)
+        self.kick()
+
+    def close(self):
+        if not self.sock: return
+        try: self.sock.close()
+        except: pass
+        self.sock = self.poller = None
+
+    def kick(self):
+        # Beacon on the next service() instead of waiting out the interval
+        self.last_beacon = time.ticks_ms() - BEACON_MS
+
+    def service(self, advertise=True):
+        if not self.sock: return
+        while self.poller.poll(0):
+            try: data, addr = self.sock.recvfrom(64)
+            except OSError: break
+            if data.startswith(b"NICLA_DISCOVER"):
+                want = data[15:].strip()
+                if not want or want == self.id_bytes: self._send(self.beacon, addr)
+        if advertise and time.ticks_diff(time.ticks_ms(), self.last_beacon) >= BEACON_MS:
+            self._send(b"NICLA_READY", (BROADCAST_IP, self.port))
+            self._send(self.beacon, (BROADCAST_IP, self.port))
+            self.last_beacon = time.ticks_ms()
+
+    def _send(self, data, addr):
+        try: self.sock.sendto(data, addr)
+        except OSError: pass
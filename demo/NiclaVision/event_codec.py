@@ -0,0 +1,80 @@
+import micropython
+
+# Events are written into one preallocated bytearray and handed out as memoryviews.
+# Slicing a memoryview allocates, so a view for every possible length is made up front.
+# A view is only valid until the next encode; the send path copies whatever it queues.
+SIZE = 128
+MAX_LABEL = 32              # Interned labels are cut to this so a det always fits
+
+@micropython.viper
+def put(dst, pos: int, src, start: int) -> int:
+    # Copy src[start:] into dst at pos; returns the new end
+    d = ptr8(dst)
+    s = ptr8(src)
+    n = int(len(src))
+    while start < n:
+        d[pos] = s[start]
+        pos += 1
+        start += 1
+    return pos
+
+@micropython.viper
+def put_int(dst, pos: int, v: int) -> int:
+    d = ptr8(dst)
+    if v < 0:
+        d[pos] = 45
+        pos += 1
+        v = 0 - v
+    i = pos
+    while True:
+        d[pos] = 48 + v % 10
+        pos += 1
+        v = v // 10
+        if v == 0: break
+    j = pos - 1
+    while i < j:
+        t = d[i]
+        d[i] = d[j]
+        d[j] = t
+        i += 1
+        j -= 1
+    return pos
+
+def intern_labels(labels):
+    # Model labels as bytes, once at load, so a detection never encodes a str
+    return [l.encode()[:MAX_LABEL] for l in labels]
+
+class EventEncoder:
+    def __init__(self, size=SIZE):
+        self.buf = bytearray(size)
+        mv = memoryview(self.buf)
+        self.views = [mv[:n] for n in range(size + 1)]
+
+    def det(self, label, dist, pos):
+        b = self.buf
+        i = put(b, 0, b'{"type":"det","label":"', 0)
+        i = put(b, i, label, 0)
+        i = put(b, i, b'","dist":', 0)
+        i = put_int(b, i, dist)
+        i = put(b, i, b',"pos":"', 0)
+        i = put(b, i, pos, 0)
+        return self.views[put(b, i, b'"}\n', 0)]
+
+    def collision(self, dist, zone):
+        b = self.buf
+        i = put(b, 0, b'{"type":"collision","dist":', 0)
+        i = put_int(b, i, dist)
+        i = put(b, i, b',"zone":"', 0)
+        i = put(b, i, zone, 0)
+        return self.views[put(b, i, b'"}\n', 0)]
+
+    def bat(self, kind, soc10):
+        # kind is b"bat_init" / b"bat_status" / b"bat_warn"; soc10 is the charge in tenths of a percent
+        b = self.buf
+        i = put(b, 0, b'{"type":"', 0)
+        i = put(b, i, kind, 0)
+        i = put(b, i, b'","soc":"', 0)
+        i = put_int(b, i, soc10 // 10)
+        b[i] = 46
+        i = put_int(b, i + 1, soc10 % 10)
+        return self.views[put(b, i, b'"}\n', 0)]
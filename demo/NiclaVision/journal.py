@@ -0,0 +1,98 @@
+import time
+import uos
+
+# Append-only event log for while no app is connected. Each line is the event JSON with
+# "t" (RTC seconds) put in front. The log is two files of up to JOURNAL_MAX/2 each. When
+# the current one is full it becomes the old one, and the previous old one is dropped.
+# The app fetches the log with JOURNAL (one JOURNAL_START payload) and clears it with JOURNAL_ACK.
+# Routine entries collect in RAM and reach flash in one write when the buffer fills or
+# JOURNAL_FLUSH_MS after the first of them; urgent ones (collisions, battery) flush at once.
+JOURNAL_FILE = "journal.log"
+JOURNAL_OLD = "journal.old"
+JOURNAL_MAX = 32768
+JOURNAL_BUF = 2048
+JOURNAL_FLUSH_MS = 30000
+
+def _size(path):
+    try: return uos.stat(path)[6]
+    except OSError: return 0
+
+class Journal:
+    def __init__(self):
+        self.f = None
+        self.size = _size(JOURNAL_FILE)
+        self.appended = 0
+        self.rotations = 0
+        self.buf = bytearray(JOURNAL_BUF)
+        self.mv = memoryview(self.buf)
+        self.fill = 0
+        self.first_ms = 0       # When the oldest unwritten entry came in
+
+    def append(self, msg, urgent=False):
+        # msg is one JSON object line (bytes or memoryview)
+        head = ('{"t":%d,' % time.time()).encode()
+        n = len(head) + len(msg) - 1
+        if self.fill + n > JOURNAL_BUF: self.flush()
+        if n > JOURNAL_BUF: return  # Never the case for events; keeps the copy below in bounds
+        if not self.fill: self.first_ms = time.ticks_ms()
+        self.mv[self.fill:self.fill + len(head)] = head
+        self.mv[self.fill + len(head):self.fill + n] = memoryview(msg)[1:]
+        self.fill += n
+        self.appended += 1
+        if urgent: self.flush()
+
+    def service(self):
+        # Main loop: write out routine entries that have waited long enough
+        if self.fill and time.ticks_diff(time.ticks_ms(), self.first_ms) > JOURNAL_FLUSH_MS: self.flush()
+
+    def flush(self):
+        if not self.fill: return
+        try:
+            if self.size + self.fill > JOURNAL_MAX // 2: self._rotate()
+            if not self.f: self.f = open(JOURNAL_FILE, "ab")
+            self.f.write(self.mv[:self.fill])
+            self.f.flush()
+            self.size += self.fill
+        except OSError as e: print("DEBUG [Journal]: Write failed", e)
+        self.fill = 0
+
+    def total(self):
+        return _size(JOURNAL_OLD) + self.size + self.fill
+
+    def chunks(self, mv):
+        # Old file first, then the current one; each view is valid until the next one
+        self.flush()
+        self.close()
+        for path in (JOURNAL_OLD, JOURNAL_FILE):
+            try: f = open(path, "rb")
+            except OSError: continue
+            try:
+                while True:
+                    n = f.readinto(mv)
+                    if not n: break
+                    yield mv[:n]
+            finally: f.close()
+
+    def clear(self):
+        self.fill = 0
+        self.close()
+        for path in (JOURNAL_OLD, JOURNAL_FILE):
+            try: uos.remove(path)
+            except OSError: pass
+        self.size = 0
+        self.appended = 0
+
+    def close(self):
+        if self.f:
+            try: self.f.close()
+            except OSError: pass
+            self.f = None
+
+    def _rotate(self):
+        self.close()
+        try: uos.remove(JOURNAL_OLD)
+        except OSError: pass
+        try: uos.rename(JOURNAL_FILE, JOURNAL_OLD)
+        except OSError: pass
+        self.size = 0
+        self.rotations += 1
@@ -1,6 +1,21 @@
-import bluetooth, network, socket, struct, time, sensor, image, gc, uos, audio, micropython, ml, os
+import bluetooth, struct, time, json, sensor, image, gc, uos, audio, micropython, ml, os
 from machine import I2C, Pin, SPI
 import vl53l1x
+import adpcm
+import metrics
+import tracer
+import memory
+import vision_handler
+from event_codec import EventEncoder, intern_labels
+from spool import AudioSpool
+from journal import Journal
+from transfer import Outbox
+from cmd_parser import LineParser, split_id, split_prio, tag
+from capture_queue import CaptureQueue, PRIO_AUDIO, PRIO_IMAGE
+from tcp_hub import TcpHub, SUB_EVENTS, SUB_MEDIA, SUB_FAST, SUB_ALL, QUEUE_LIMIT
+from udp_events import EventChannel
+from discovery import Discovery
+import wifi_link
 from lsm6dsox import LSM6DSOX
 from pyb import LED
 
@@ -8,17 +23,46 @@ micropython.alloc_emergency_exception_buf(100)
 led_red, led_green, led_blue = LED(1), LED(2), LED(3)
 
 TCP_PORT, UDP_DISC_PORT = 5005, 5006
-UDP_IP = "255.255.255.255"
+FW_VERSION = "2.1.0"
+CAPS = ["adpcm", "xfer", "sub", "udp_events", "heartbeat", "req_id", "stats", "trace", "mem", "memo", "journal", "burst", "doc", "progressive", "roi", "queue"]
 REC_SECONDS, SAMPLE_RATE = 2.5, 16000
 TOTAL_AUDIO_BYTES = int(SAMPLE_RATE * 1 * 2 * REC_SECONDS)
 AUDIO_CHUNK_SIZE = 1024
 NUM_AUDIO_CHUNKS = (TOTAL_AUDIO_BYTES // AUDIO_CHUNK_SIZE) + 1
 FUEL_GAUGE_ADDR = 0x36
 
+VAD_LEVEL = 600           # Mean abs amplitude that counts as voice
+VAD_SILENCE_MS = 700      # Trailing silence that ends a recording
+VAD_PREROLL_MS = 150      # Kept before the first voiced buffer
+VAD_TAIL_MS = 200         # Kept after the last voiced buffer
+VAD_SILENCE_BYTES = SAMPLE_RATE * 2 * VAD_SILENCE_MS // 1000
+VAD_PREROLL_BYTES = SAMPLE_RATE * 2 * VAD_PREROLL_MS // 1000
+VAD_TAIL_BYTES = SAMPLE_RATE * 2 * VAD_TAIL_MS // 1000
+
+JOURNAL_DET_MS = 1000     # Offline, a det is journaled at most this often
+MEMO_MAX_S = 60           # Voice memos spool to flash, so only storage bounds them
+MEMO_SILENCE_MS = 3000    # Memos tolerate longer pauses than a command
+MEMO_SILENCE_BYTES = SAMPLE_RATE * 2 * MEMO_SILENCE_MS // 1000
+
 TOF_WARN_DIST = 1500
 TOF_ALERT_DIST = 800
 TOF_CRITICAL_DIST = 400
 TOF_POLL_MS = 150
+CAMERA_SETTLE_MS = 2000   # Auto exposure settling, done in the background at boot
+BURST_FRAMES = 5          # take_picture_burst default; only the sharpest frame is encoded
+BURST_MAX = 10
+DOC_QUALITY = 60          # Document JPEGs: text edges need more than the 40 used for scenes
+KB_BUCKETS = (4, 8, 16, 32, 64, 128, 256)
+THUMB_SCALE = 0.5         # take_picture_prog preview: QVGA -> 160x120
+THUMB_QUALITY = 25
+MEDIA_SLICE_MS = 8        # Raw payload bytes a job slice may keep sending for
+ROI_PAD = 2               # take_picture_roi default padding, in heatmap cells on each side
+ROI_QUALITY = 80          # Crops are small, so they can afford a much better JPEG
+ROI_MAX_AGE_MS = 3000     # Older detections fall back to the full frame
+CAPTURE_CMD = {"img": "take_picture", "aud": "RECORD", "memo": "RECORD_MEMO"}  # Reply prefix per queued kind
+
+DEBUG_EVENTS = False      # Per-event prints allocate; keep them off the steady-state path
+ALLOC_BUCKETS = (0, 64, 256, 1024, 4096, 16384)
 
 PROV_SERVICE_UUID = bluetooth.UUID("12345678-1234-1234-1234-123456789abc")
 SSID_CHAR_UUID = bluetooth.UUID("12345678-1234-1234-1234-123456789abd")
@@ -26,21 +70,51 @@ PASS_CHAR_UUID = bluetooth.UUID("12345678-1234-1234-1234-123456789abe")
 
 g_audio_chunks = []
 g_audio_written = 0
-g_wifi_connected = False
 g_ssid, g_pass = "", ""
 
+@micropython.viper
+def _abs_sum(buf, n: int) -> int:
+    # Sum of |sample| over every 4th 16-bit sample, cheap enough for the audio callback
+    p = ptr16(buf)
+    acc = 0
+    i = 0
+    while i < n:
+        s = p[i]
+        if s > 32767: s = 65536 - s
+        acc += s
+        i += 4
+    return acc
+
 class NiclaSystem:
     def __init__(self):
-        self.server_sock = None
-        self.tcp_conn = None
-        self.last_broadcast = 0
+        self.hub = TcpHub(TCP_PORT)
+        self.events = EventChannel(self.hub)
+        self.discovery = Discovery(UDP_DISC_PORT, TCP_PORT, FW_VERSION, CAPS)
         self.last_bat_check = 0
-        self.wlan = None
+        self.link = None
+        self.wifi_up = False
+        self.server_ready = False
         self.ble = bluetooth.BLE()
         self.ble.active(True)
-        self.req_image = False
-        self.req_audio = False
+        self.captures = CaptureQueue()  # Pictures and recordings waiting their turn
+        self.cur = None            # The capture request the running job serves
+        self.tx = None             # Picture payload still going out while the next capture runs
+        self.img_slot = 0          # Alternates temp files so one can encode while the other sends
+        self.capture_seq = 0       # Capture ID shared by a preview and its full picture
+        self.last_cell = [0, 0, 1, 1, 0]  # Last detection: cell x, y, grid w, h, ticks; updated in place
+        self.req_trace = None      # Client waiting for a trace dump
+        self.memo_max_bytes = 0
+        self.spool = None
+        self.journal = Journal()
+        self.journal_last = {}     # key -> ticks of the last journaled event
+        self.req_journal = None    # Client waiting for the journal
         self.recording = False
+        self.vad_start = -1
+        self.vad_end = 0
+        self.audio_fmt = "pcm"
+        self.adpcm_enc = adpcm.Encoder()
+        self.xfer_mode = False
+        self.outbox = Outbox(self.send_media, ready=lambda n: self.hub.ready(SUB_MEDIA, n))
         self.trigger_wifi_connect = False
         self.net = None
         self.labels = None
@@ -55,34 +129,63 @@ class NiclaSystem:
         self.tap_settle_time = 0
         self.last_accel = (0, 0, 0)
         self.last_tof_poll = 0
-        self.last_tof_zone = "clear"
-
-        self._init_hardware()
-
-        global g_audio_chunks
-        try:
-            gc.collect()
-            g_audio_chunks = [bytearray(AUDIO_CHUNK_SIZE) for _ in range(NUM_AUDIO_CHUNKS)]
-            print("DEBUG [Audio]: Buffer allocated")
-        except: print("DEBUG [Audio]: Alloc Failed")
+        self.last_tof_zone = b"clear"
+        self.enc = EventEncoder()
+        self.label_bytes = None
+        self.pred_in = [None]       # Reused input list for net.predict
+        self.job = None
+        self.job_t0 = 0
+        self.job_slice_max = 0
+        self.job_tof_gap = 0
+        self.worst_tof_gap = 0
+        self.file_buf = bytearray(1024)
+        self.file_mv = memoryview(self.file_buf)
+        self.primary = None         # Oldest client; only it may change the media framing (AUDIO_FMT / XFER)
+        self.cam_ready = False
+        self.detect_mode = None     # Camera mode matched to the model input, set at model load
+        self.req_bench = None       # Client waiting for a camera benchmark
+        self.audio_ready = False
+        self.boot_ms = {}           # Subsystem -> ms since reset when it became ready
+        self.first_conn = False
+        self.first_frame = False
+        self.first_det = False
 
+        # Networking first: WiFi or provisioning starts on the first loop pass and the
+        # rest of the hardware comes up in _boot_stages(), one step per pass
         saved = self._load_config()
         if saved:
             global g_ssid, g_pass
             g_ssid, g_pass = saved
             self.trigger_wifi_connect = True
         else: self._setup_ble_provisioning()
+        self.boot = self._boot_stages()
+        self._ready("net")
+
+    def _ready(self, name):
+        # ticks_ms counts from reset, so it is the time since boot
+        t = time.ticks_ms()
+        self.boot_ms[name] = t
+        metrics.gauge("boot_" + name + "_ms", t)
+        print(f"DEBUG [Boot]: {name} ready at {t} ms")
+
+    def step_boot(self):
+        try: next(self.boot)
+        except StopIteration: self.boot = None
+        except Exception as e: print("DEBUG [Boot]: Error", e); self.boot = None
+        if self.boot is None: self._refuse_unavailable()
 
-    def _init_hardware(self):
-        print("DEBUG [System]: Init Start")
+    def _boot_stages(self):
+        # Big buffers first while the heap is still unfragmented
+        global g_audio_chunks
         try:
-            sensor.reset()
-            sensor.set_pixformat(sensor.RGB565)
-            sensor.set_framesize(sensor.QVGA)
-            sensor.set_windowing((240, 240))
-            sensor.skip_frames(time=2000)
-            print("DEBUG [Sensor]: OK")
-        except: print("DEBUG [Sensor]: FAIL")
+            memory.collect()
+            g_audio_chunks = [bytearray(AUDIO_CHUNK_SIZE) for _ in range(NUM_AUDIO_CHUNKS)]
+            print("DEBUG [Audio]: Buffer allocated")
+        except: print("DEBUG [Audio]: Alloc Failed")
+        try: self.spool = AudioSpool()  # Fixed footprint however long the memo
+        except MemoryError: print("DEBUG [Memo]: Alloc Failed")
+        self._ready("buffers")
+        yield
 
         try:
             i2c_bus = I2C(2)
@@ -94,18 +197,47 @@ class NiclaSystem:
                 self.fuel_gauge_i2c = i2c_bus
                 print("DEBUG [Fuel]: OK")
         except: print("DEBUG [I2C]: FAIL")
+        self._ready("i2c")
+        yield
 
         try:
             self.lsm = LSM6DSOX(SPI(5), cs=Pin("PF6", Pin.OUT_PP, Pin.PULL_UP))
             print("DEBUG [IMU]: OK")
         except: self.lsm = None
+        self._ready("imu")
+        yield
 
         try:
             audio.init(channels=1, frequency=SAMPLE_RATE, gain_db=24)
-            self.net = ml.Model("trained.tflite", load_to_fb=True)
-            self.labels = [line.rstrip('\n') for line in open("labels.txt")]
-            print("DEBUG [ML]: OK")
-        except: print("DEBUG [ML]: FAIL")
+            self.audio_ready = bool(g_audio_chunks)
+            self._ready("audio")
+        except: print("DEBUG [Audio]: FAIL")
+        yield
+
+        if vision_handler.init_camera(settle_ms=0):
+            # Let auto exposure settle a frame per pass instead of blocking in skip_frames
+            t0 = time.ticks_ms()
+            while time.ticks_diff(time.ticks_ms(), t0) < CAMERA_SETTLE_MS:
+                sensor.snapshot()
+                yield
+            self.cam_ready = True
+            self._ready("camera")
+            yield
+
+            try:
+                self.net = ml.Model("trained.tflite", load_to_fb=True)
+                self.labels = [line.rstrip('\n') for line in open("labels.txt")]
+                self.label_bytes = intern_labels(self.labels)
+                w, h, c = vision_handler.model_input(self.net)
+                self.detect_mode = vision_handler.detect_mode(w, h, c)
+                vision_handler.set_mode(self.detect_mode, 2)
+                print(f"DEBUG [ML]: input {w}x{h}x{c}, capturing {self.detect_mode[2]}")
+                self._ready("model")
+            except: print("DEBUG [ML]: FAIL")
+            yield
+
+        memory.init()
+        self._ready("boot")
 
     def get_soc(self):
         if not self.fuel_gauge_i2c: return None
@@ -119,9 +251,10 @@ class NiclaSystem:
         except: return None
 
     def check_imu(self):
-        if not self.lsm or self.req_audio or self.req_image: return
+        if not self.lsm or self.captures.items or self.recording: return
         try:
             x, y, z = self.lsm.accel()
+            metrics.inc("imu")
             dz = abs(z - self.last_accel[2])
             self.last_accel = (x, y, z)
             now = time.ticks_ms()
@@ -130,12 +263,11 @@ class NiclaSystem:
             if self.tap_count > 0 and time.ticks_diff(now, self.last_tap_time) > 600:
                 if self.tap_count == 1: # Double Tap
                     print("DEBUG [IMU]: RECORDING")
-                    self.req_audio = True
+                    if not self._unavailable("aud"): self.captures.push("aud", None, PRIO_AUDIO)
                 elif self.tap_count >= 2: # Triple Tap
                     print("DEBUG [IMU]: BATTERY")
                     soc = self.get_soc()
-                    msg = '{"type":"bat_status","soc":"%.1f"}\n' % (soc if soc else 0)
-                    self.send_tcp_packet(msg.encode())
+                    self.send_tcp_packet(self.enc.bat(b"bat_status", int(soc * 10) if soc else 0))
                 self.tap_count = 0
 
             if dz > 4.5: # Hard tap detection
@@ -149,135 +281,523 @@ class NiclaSystem:
         except Exception as e: print("DEBUG [IMU]: Error", e)
 
     def check_tof(self):
-        if not self.tof or self.req_image or self.req_audio: return
+        # Also runs between job slices so obstacle alerts continue during transfers
+        if not self.tof: return
         now = time.ticks_ms()
-        if time.ticks_diff(now, self.last_tof_poll) < TOF_POLL_MS: return
+        gap = time.ticks_diff(now, self.last_tof_poll)
+        if gap < TOF_POLL_MS: return
+        if self.job and gap > self.job_tof_gap: self.job_tof_gap = gap
         self.last_tof_poll = now
         try:
             dist = self.tof.read()
+            metrics.inc("tof")
+            tracer.point(tracer.TOF, arg=dist)
             if dist <= 0 or dist > 8000: return  # Out of range / bad read
 
             if dist <= TOF_CRITICAL_DIST:
-                zone = "critical"
+                zone = b"critical"
             elif dist <= TOF_ALERT_DIST:
-                zone = "alert"
+                zone = b"alert"
             elif dist <= TOF_WARN_DIST:
-                zone = "warning"
+                zone = b"warning"
             else:
-                zone = "clear"
+                zone = b"clear"
 
             if zone != self.last_tof_zone:
                 self.last_tof_zone = zone
-                if zone != "clear":
-                    msg = '{"type":"collision","dist":%d,"zone":"%s"}\n' % (dist, zone)
-                    print(f"DEBUG [ToF]: {zone} at {dist}mm")
-                    self.send_tcp_packet(msg.encode())
+                if zone != b"clear":
+                    if DEBUG_EVENTS: print(f"DEBUG [ToF]: {zone} at {dist}mm")
+                    self.send_event("collision", self.enc.collision(dist, zone), zone != b"warning")
                 else:
-                    self.send_tcp_packet(b'{"type":"collision","dist":0,"zone":"clear"}\n')
+                    self.send_event("collision", b'{"type":"collision","dist":0,"zone":"clear"}\n')
         except Exception as e: print("DEBUG [ToF]: Error", e)
 
     def run_active_detection(self):
-        if not self.net or self.req_image or self.req_audio: return
+        # Not while a raw payload is out: its det events would only be parked, crowding out collisions
+        if not self.net or self.captures.items or self.hub.raw_open: return
         now = time.ticks_ms()
 
-        if self.tcp_conn:
-            if not self.sent_initial_bat and time.ticks_diff(now, self.connection_time) > 2000:
-                soc = self.get_soc()
-                if soc: self.send_tcp_packet(('{"type":"bat_init","soc":"%.1f"}\n'%soc).encode())
-                self.sent_initial_bat = True
+        if self.online() and not self.sent_initial_bat and time.ticks_diff(now, self.connection_time) > 2000:
+            soc = self.get_soc()
+            if soc: self.send_tcp_packet(self.enc.bat(b"bat_init", int(soc * 10)))
+            self.sent_initial_bat = True
 
-            if time.ticks_diff(now, self.last_bat_check) > 60000:
-                self.last_bat_check = now
-                soc = self.get_soc()
-                if soc and soc <= 20.0 and not self.low_bat_warned:
-                    self.send_tcp_packet(b'{"type":"bat_warn","soc":"20.0"}\n')
-                    self.low_bat_warned = True
+        if time.ticks_diff(now, self.last_bat_check) > 60000:
+            # Also while offline, so a low battery lands in the journal
+            self.last_bat_check = now
+            soc = self.get_soc()
+            if soc and soc <= 20.0 and not self.low_bat_warned:
+                self.send_tcp_packet(b'{"type":"bat_warn","soc":"20.0"}\n')
+                self.low_bat_warned = True
 
+        a0 = gc.mem_alloc()
         try:
+            t0 = time.ticks_ms()
+            tracer.begin(tracer.SNAPSHOT)
             img = sensor.snapshot()
-            raw_output = self.net.predict([img])
+            tracer.end(tracer.SNAPSHOT)
+            metrics.since("snap_ms", t0)
+            t0 = time.ticks_ms()
+            tracer.begin(tracer.PREDICT)
+            self.pred_in[0] = img
+            raw_output = self.net.predict(self.pred_in)
+            tracer.end(tracer.PREDICT)
+            metrics.since("predict_ms", t0)
+            metrics.inc("frames")
+            if not self.first_frame: self.first_frame = True; self._ready("first_frame")
             heatmap = raw_output[0]
+            t0 = time.ticks_ms()
+            tracer.begin(tracer.DECODE)
 
-            best_label, best_conf, best_x = None, 0.0, 0
-            if len(heatmap.shape) == 4:
-                grid_x, classes = heatmap.shape[2], heatmap.shape[3]
-                cell_w = img.width() / grid_x
-                for y in range(heatmap.shape[1]):
+            best_c, best_conf, best_cx, best_cy = 0, 0.45, 0, 0
+            shape = heatmap.shape
+            if len(shape) == 4:
+                grid_y, grid_x, classes = shape[1], shape[2], shape[3]
+                hm = heatmap[0]
+                for y in range(grid_y):
+                    row = hm[y]
                     for x in range(grid_x):
+                        cell = row[x]
                         for c in range(1, classes):
-                            score = heatmap[0][y][x][c]
-                            if score > 0.45 and score > best_conf:
-                                best_conf, best_x = score, int(x*cell_w+cell_w/2)
-                                best_label = self.labels[c] if self.labels else str(c)
+                            score = cell[c]
+                            if score > best_conf: best_conf, best_c, best_cx, best_cy = score, c, x, y
+            tracer.end(tracer.DECODE)
+            metrics.since("decode_ms", t0)
 
-            if best_label:
-                pos = "left" if best_x < 80 else "right" if best_x > 160 else "straight"
+            if best_c:
+                lc = self.last_cell
+                lc[0], lc[1], lc[2], lc[3], lc[4] = best_cx, best_cy, grid_x, grid_y, now
+                third = (6 * best_cx + 3) // (2 * grid_x)  # Which third the cell centre is in, any frame size
+                pos = b"left" if third < 1 else b"right" if third > 1 else b"straight"
                 distance = self.tof.read() if self.tof else 0 # Simple read
-
-                res = '{"type":"det","label":"%s","dist":%d,"pos":"%s"}\n' % (best_label, distance, pos)
-                print(f"DEBUG [ML]: Sent {best_label} at {distance}mm")
-                self.send_tcp_packet(res.encode())
+                label = self.label_bytes[best_c] if self.label_bytes and best_c < len(self.label_bytes) else str(best_c).encode()
+                if DEBUG_EVENTS: print(f"DEBUG [ML]: Sent {label} at {distance}mm")
+                metrics.inc("det")
+                if not self.first_det: self.first_det = True; self._ready("first_det")
+                self.send_event("det", self.enc.det(label, distance, pos))
         except Exception as e: print("DEBUG [ML]: Error", e)
-        finally: gc.collect()
+        a = gc.mem_alloc() - a0
+        if a >= 0: metrics.observe("frame_alloc_b", a, ALLOC_BUCKETS)  # Negative: a collection ran mid-frame
+
+    def run_jobs(self):
+        # Captures run as generators, one slice per main loop pass, so check_tof keeps sampling.
+        # A finished picture's send (self.tx) gets its own slice, so the next capture overlaps it.
+        if self.tx:
+            try: next(self.tx)
+            except StopIteration: self.tx = None
+            except Exception as e: print("DEBUG [Tx]: Error", e); self.tx = None
+        if self.job:
+            t0 = time.ticks_ms()
+            tracer.begin(tracer.JOB)
+            try: next(self.job)
+            except StopIteration: self._end_job()
+            except Exception as e: print("DEBUG [Job]: Error", e); self._end_job()
+            tracer.end(tracer.JOB)
+            dt = time.ticks_diff(time.ticks_ms(), t0)
+            metrics.observe("slice_ms", dt)
+            if dt > self.job_slice_max: self.job_slice_max = dt
+        elif self.outbox.busy():
+            try: self.outbox.service()
+            except Exception as e: print("DEBUG [Xfer]: Error", e); self.outbox.active = []
+        elif self.req_trace: self._start_job(self._send_trace(self.req_trace))
+        elif self.req_bench and self.net: self._start_job(self._bench_camera(self.req_bench))
+        elif self.req_journal: self._start_job(self._send_journal(self.req_journal))
+        elif self.captures.items and not self.online(): self._journal_missed()
+        else:
+            r = self.captures.pop(self._capture_ready) if self.captures.items else None
+            if r: self._start_capture(r)
+            else: self.run_active_detection()
+
+    def _capture_ready(self, kind):
+        return self.cam_ready if kind == "img" else self.audio_ready
 
-    def process_image(self):
+    def _unavailable(self, kind):
+        # Boot is over and the subsystem did not come up, so the request would wait forever
+        return self.boot is None and not self._capture_ready(kind)
+
+    def _refuse_unavailable(self):
+        # Requests queued while booting, for a camera or microphone that then failed
+        for r in [r for r in self.captures.items if self._unavailable(r.kind)]:
+            self.captures.items.remove(r)
+            print(f"DEBUG [Boot]: No {r.kind} subsystem, refusing queued request")
+            self.send_tcp_packet(tag(CAPTURE_CMD[r.kind] + ":unavailable\n", r.rid).encode())
+
+    def _start_capture(self, r):
+        metrics.since("capture_wait_ms", r.t)
+        self.cur = r
+        if r.kind == "img": self._start_job(self.process_image(r))
+        elif r.kind == "aud": self._start_job(self.process_audio(r))
+        else: self._start_job(self.process_memo(r))
+
+    def _cancel(self, rid):
+        # Queued requests go at once. The running one only before its payload starts, since
+        # cutting a raw IMG_START/AUD_START short would desync the stream.
+        n = self.captures.cancel(None if rid == "*" else rid)
+        r = self.cur
+        if r and self.job and (rid == "*" or r.rid == rid) and (self.tx or not self.hub.raw_open):
+            self.job.close()  # Its finally blocks stop the microphone and restore the camera
+            for tid in r.xfer: self.outbox.cancel(tid)  # XFER streams would otherwise keep going
+            self._end_job()
+            n += 1
+        if n: metrics.inc("capture_cancel", n)
+        return n
+
+    def _start_job(self, job):
+        self.job, self.job_t0 = job, time.ticks_ms()
+        self.job_slice_max, self.job_tof_gap = 0, 0
+
+    def _end_job(self):
+        self.job = None
+        self.cur = None
+        if self.job_tof_gap > self.worst_tof_gap: self.worst_tof_gap = self.job_tof_gap
+        metrics.since("job_ms", self.job_t0)
+        metrics.observe("tof_gap_ms", self.job_tof_gap)
+        # Sampling delay while busy is about one ToF gap plus one slice; for clients that get
+        # events inline, delivery also waits out any raw payload (parked_ms in the stats)
+        print(f"DEBUG [Job]: {time.ticks_diff(time.ticks_ms(), self.job_t0)} ms, max slice {self.job_slice_max} ms, max ToF gap {self.job_tof_gap} ms (worst {self.worst_tof_gap} ms)")
+
+    def _send_trace(self, client):
+        # Debug dump as JSON lines, paced by the client's queue
+        self.req_trace = None
+        lines = tracer.dump_lines()
+        try:
+            for line in lines:
+                while client.queued and client.queued + len(line) > QUEUE_LIMIT: yield
+                if client not in self.hub.clients: return
+                self.send_tcp_packet(line, client)
+                yield
+        finally: lines.close()  # Re-enables tracing even if the client left mid-dump
+
+    def _bench_camera(self, client):
+        # The old 240x240 RGB565 capture against the model-sized one
+        self.req_bench = None
+        try:
+            r = yield from vision_handler.benchmark(self.net, (vision_handler.LEGACY_MODE, self.detect_mode or vision_handler.LEGACY_MODE))
+            print(f"DEBUG [Bench]: {r}")
+            if client in self.hub.clients: self.send_tcp_packet((json.dumps({"type": "bench_cam", "modes": r}) + "\n").encode(), client)
+        finally: vision_handler.set_mode(self.detect_mode or vision_handler.LEGACY_MODE, 2)
+
+    def _send_journal(self, client):
+        # The whole offline log as one JOURNAL_START:<size>,<now> payload to the asking client
+        self.req_journal = None
+        size = self.journal.total()
+        segs = self.journal.chunks(self.file_mv)
+        while self.tx: yield  # A picture payload is still going out
+        self.hub.begin_raw(client)
+        try:
+            self.hub.publish(("JOURNAL_START:%d,%d\n" % (size, time.time())).encode(), SUB_MEDIA, client)
+            for seg in segs:
+                while client.queued and client.queued + len(seg) > QUEUE_LIMIT: yield
+                if client not in self.hub.clients: return
+                self.hub.publish(seg, SUB_MEDIA, client)
+                yield
+            print(f"DEBUG [Journal]: Sent {size} bytes, kept until JOURNAL_ACK")
+        finally:
+            segs.close()
+            self.hub.end_raw()
+
+    def _journal_missed(self):
+        # Captures asked for with nobody to receive them are noted instead of taken
+        for r in self.captures.take_all():
+            self.journal.append(('{"type":"capture","kind":"%s","status":"offline"}\n' % r.kind).encode())
+
+    def _journal_event(self, key, msg):
+        # Offline: keep collisions and battery events, throttle detections
+        now = time.ticks_ms()
+        if key == "det" and time.ticks_diff(now, self.journal_last.get(key, now - JOURNAL_DET_MS)) < JOURNAL_DET_MS: return
+        self.journal_last[key] = now
+        self.journal.append(msg, key != "det")  # Only detections wait in RAM for a batched write
+        metrics.inc("journaled")
+
+    def _send_media_slices(self, segs):
+        # From a job: wait for the previous picture's send to finish first
+        while self.tx: yield
+        yield from self._media_slices(segs)
+
+    def _media_slices(self, segs):
+        # Raw payload: hold events back so they cannot land inside it
+        self.hub.begin_raw()
+        try:
+            # Several segments per slice, so the rate is not one segment per loop pass
+            t0 = time.ticks_ms()
+            for seg in segs:
+                if not self.hub.ready(SUB_MEDIA, len(seg)):
+                    self.hub.pump()
+                    while not self.hub.ready(SUB_MEDIA, len(seg)):
+                        yield
+                        t0 = time.ticks_ms()
+                self.send_media(seg)
+                if time.ticks_diff(time.ticks_ms(), t0) >= MEDIA_SLICE_MS:
+                    yield
+                    t0 = time.ticks_ms()
+        finally: self.hub.end_raw()
+
+    def process_image(self, r):
         print("DEBUG [Image]: Snap")
-        self.req_image = False
         led_blue.on()
+        t0 = r.t  # Latency counts the time spent queued
+        rid = r.rid
+        burst, doc, thumb, pad = r.opts
+        if pad >= 0 and time.ticks_diff(t0, self.last_cell[4]) > ROI_MAX_AGE_MS:
+            print("DEBUG [Image]: No recent detection, sending the whole frame")
+            pad = -1
+        still = doc or pad >= 0 or self.detect_mode is not None
+        restore = self.detect_mode or vision_handler.LEGACY_MODE
+        stat = "doc" if doc else "roi" if pad >= 0 else "img"
+        quality = DOC_QUALITY if doc else ROI_QUALITY if pad >= 0 else 40
+        extra, fb, path = None, False, None
         try:
-            img = sensor.snapshot()
-            img.save("temp.jpg", quality=40)
-            size = os.stat("temp.jpg")[6]
-            self.send_tcp_packet(f"IMG_START:{size}\n".encode())
-            with open("temp.jpg", 'rb') as f:
-                while True:
-                    chunk = f.read(1024)
-                    if not chunk: break
-                    self.send_tcp_packet(chunk)
-            print("DEBUG [Image]: Sent")
+            if doc: vision_handler.set_mode(vision_handler.doc_mode(), 3)
+            elif still: vision_handler.set_mode(vision_handler.STILL_MODE, 2)  # Full frame, not the model-sized one
+            if burst:
+                img, score, ms, best = yield from self._burst(burst)
+                fb = True
+                extra = "%d,%d,%d" % (score, ms, burst)  # sharpness, burst time, frames
+                print(f"DEBUG [Image]: Burst best {best}/{burst}, sharpness {score}, {ms} ms")
+            else:
+                tracer.begin(tracer.SNAPSHOT)
+                img = sensor.snapshot()
+                tracer.end(tracer.SNAPSHOT)
+            if doc:
+                roi = vision_handler.document(img, doc == 2)
+                print(f"DEBUG [Image]: Document {img.width()}x{img.height()}, page {roi}")
+            if thumb:
+                # Detection is paused while a job runs, so the frame buffer stays ours across these slices
+                self.capture_seq += 1
+                extra = str(self.capture_seq)
+                yield from self._send_thumb(img, extra, rid)
+                metrics.since("thumb_ms", t0)
+            if pad >= 0:
+                lc = self.last_cell
+                roi = vision_handler.cell_roi(restore, lc, (lc[2], lc[3]), img.width(), img.height(), pad)
+                img.crop(roi=roi)
+                extra = "%d,%d,%d,%d" % roi  # Crop rectangle in the full still frame
+                print(f"DEBUG [Image]: Crop {roi} around cell {lc[0]},{lc[1]}")
+            te = time.ticks_ms()
+            if self.xfer_mode:
+                jpg = img.to_jpeg(quality=quality, copy=True)  # Held in RAM until ACK
+                metrics.since(stat + "_enc_ms", te)
+                if still: vision_handler.set_mode(restore); still = False
+                size = jpg.size()
+                while self.tx: yield  # At most one encoded picture waits for the link
+                self.outbox.start("img", [jpg.bytearray()], jpg, rid, extra)
+                self.tx = self._image_tx(self._drain_outbox(), stat, t0, size)
+            else:
+                # Alternate files: this one is written while the previous one may still be sending
+                self.img_slot ^= 1
+                path = "temp%d.jpg" % self.img_slot
+                img.save(path, quality=quality)
+                metrics.since(stat + "_enc_ms", te)
+                if still: vision_handler.set_mode(restore); still = False
+                size = os.stat(path)[6]
+                head = f"IMG_START:{size},{extra}\n" if extra else f"IMG_START:{size}\n"
+                while self.tx: yield
+                self.tx, path = self._image_tx(self._send_file(path, tag(head, rid).encode()), stat, t0, size, path), None
         except Exception as e: print("DEBUG [Image]: Error", e)
         finally:
-            try: uos.remove("temp.jpg")
-            except: pass
-            led_blue.off(); gc.collect()
+            if fb: sensor.dealloc_extra_fb()
+            if still: vision_handler.set_mode(restore)
+            if path:  # Not handed over to the sender
+                try: uos.remove(path)
+                except OSError: pass
+            led_blue.off()
 
-    def process_audio(self):
+    def _image_tx(self, sends, stat, t0, size, path=None):
+        # Runs as self.tx beside the next job; the metrics cover the request end to end
+        te = time.ticks_ms()
+        try:
+            yield from sends
+            # Whole, document and cropped pictures side by side in the stats report
+            metrics.since(stat + "_tx_ms", te)
+            metrics.since(stat + "_ms", t0)
+            metrics.observe(stat + "_kb", size // 1024, KB_BUCKETS)
+            print("DEBUG [Image]: Sent")
+        finally:
+            if path:
+                try: uos.remove(path)
+                except OSError: pass
+            memory.request()
+
+    def _send_file(self, path, first):
+        with open(path, 'rb') as f:
+            yield from self._media_slices(self._file_chunks(f, first))
+
+    def _drain_outbox(self):
+        while self.outbox.service(): yield
+
+    def _want_picture(self, rid, prio, burst=0, doc=0, thumb=False, roi=-1):
+        # Picture variants are exclusive per request: (burst frames, doc mode, preview, ROI padding)
+        return self.captures.push("img", rid, prio, (burst, doc, thumb, roi)) is not None
+
+    def _send_thumb(self, img, cap, rid):
+        small = img.copy(x_scale=THUMB_SCALE, y_scale=THUMB_SCALE)
+        jpg = small.to_jpeg(quality=THUMB_QUALITY, copy=True)
+        small = None
+        if self.xfer_mode:
+            self.cur.xfer.append(self.outbox.start("thumb", [jpg.bytearray()], jpg, rid, cap))
+            while self.outbox.service(): yield
+        else:
+            head = tag(f"THUMB_START:{jpg.size()},{cap}\n", rid).encode()
+            yield from self._send_media_slices((head, jpg.bytearray()))
+        print(f"DEBUG [Image]: Preview {jpg.size()} B sent")
+
+    def _burst(self, n):
+        # One frame per slice; the sharpest so far is kept in an extra framebuffer so only it gets encoded
+        t0 = time.ticks_ms()
+        keep, best_score, best, done = None, -1, 0, False
+        try:
+            for i in range(n):
+                tracer.begin(tracer.SNAPSHOT)
+                img = sensor.snapshot()
+                tracer.end(tracer.SNAPSHOT)
+                s = vision_handler.sharpness(img)
+                if s > best_score:
+                    if keep is None: keep = sensor.alloc_extra_fb(img.width(), img.height(), sensor.RGB565)
+                    keep.replace(img)
+                    best_score, best = s, i
+                yield
+            done = True
+        finally:
+            # Errors and CANCEL (GeneratorExit) alike; on success the caller owns and frees it
+            if not done and keep is not None: sensor.dealloc_extra_fb()
+        return keep, best_score, time.ticks_diff(time.ticks_ms(), t0), best
+
+    def _file_chunks(self, f, first):
+        # Reuses one buffer; publish() copies whatever it has to queue before the next read
+        yield first
+        while True:
+            n = f.readinto(self.file_buf)
+            if not n: break
+            yield self.file_mv[:n]
+
+    def process_audio(self, r):
         print("DEBUG [Audio]: Rec Start")
         led_red.on()
         global g_audio_chunks, g_audio_written
-        gc.collect()
+        self.outbox.drop("aud")  # Its PCM lives in the chunks we are about to overwrite
+        memory.collect()  # Deliberate pause now rather than one inside the recording
         try:
             self.rec_idx, self.rec_offset, g_audio_written = 0, 0, 0
+            self.vad_start, self.vad_end = -1, 0
             self.recording = True
             audio.start_streaming(self._audio_callback)
-            while self.recording: time.sleep_ms(10)
+            while self.recording: yield
             audio.stop_streaming()
             led_red.off(); led_blue.on()
 
-            total_len = 44 + g_audio_written
-            self.send_tcp_packet(f"AUD_START:{total_len}\n".encode())
-            header = struct.pack('<4sI4s4sIHHIIHH4sI', b'RIFF', 36+g_audio_written, b'WAVE', b'fmt ', 16, 1, 1, SAMPLE_RATE, SAMPLE_RATE*2, 2, 16, b'data', g_audio_written)
-            self.send_tcp_packet(header)
-
-            for i in range(min(self.rec_idx + 1, len(g_audio_chunks))):
-                chunk = g_audio_chunks[i]
-                length = AUDIO_CHUNK_SIZE if i != self.rec_idx else self.rec_offset
-                if chunk and length > 0:
-                    mv = memoryview(chunk)[:length]
-                    off = 0
-                    while off < length:
-                        end = min(off + 1024, length)
-                        self.send_tcp_packet(mv[off:end])
-                        off = end
+            # Trim leading/trailing silence; no voice at all keeps the full take
+            start, end = 0, g_audio_written
+            if self.vad_start >= 0:
+                start = self.vad_start & ~1
+                end = min(g_audio_written, self.vad_end + VAD_TAIL_BYTES) & ~1
+            data_len = end - start
+            print(f"DEBUG [Audio]: {data_len}/{g_audio_written} bytes after VAD")
+
+            header, total_len = self._audio_header(data_len)
+
+            segs = []
+            off = start
+            while off < end:
+                i, pos = off // AUDIO_CHUNK_SIZE, off % AUDIO_CHUNK_SIZE
+                n = min(AUDIO_CHUNK_SIZE - pos, end - off)
+                segs.append(memoryview(g_audio_chunks[i])[pos:pos+n])
+                off += n
+
+            if self.xfer_mode:
+                if self.audio_fmt == "adpcm": segs = [self._adpcm_body(segs, total_len - len(header))]
+                r.xfer.append(self.outbox.start("aud", [header] + segs, None, r.rid))
+                while self.outbox.service(): yield
+            else:
+                if self.audio_fmt == "adpcm":
+                    self.adpcm_enc.reset()
+                    segs = self._adpcm_blocks(segs)
+                yield from self._send_media_slices(self._audio_parts(tag(f"AUD_START:{total_len}\n", r.rid).encode(), header, segs))
             print("DEBUG [Audio]: Sent")
-        except: pass
-        finally: self.req_audio = False; led_red.off(); led_blue.off(); gc.collect()
+        except Exception as e: print("DEBUG [Audio]: Error", e)
+        finally:
+            if self.recording: self.recording = False; audio.stop_streaming()
+            led_red.off(); led_blue.off(); memory.request()
+
+    def process_memo(self, req):
+        # Long take spooled to flash in the background, then streamed with the usual AUD_START framing
+        print("DEBUG [Memo]: Rec Start")
+        self.memo_max_bytes = req.opts
+        led_red.on()
+        sp = self.spool
+        try:
+            sp.open()
+            self.vad_start, self.vad_end = -1, 0
+            self.recording = True
+            audio.start_streaming(self._memo_callback)
+            while self.recording:
+                sp.service()
+                yield
+            audio.stop_streaming()
+            r = sp.finish()
+            print(f"DEBUG [Memo]: {r['bytes']} bytes in {r['ms']} ms, write {r['write_kbps']} KB/s ({r['write_busy']} busy), dropped {r['dropped']}")
+            metrics.inc("memo_drop", r["dropped"])
+            metrics.gauge("memo_write_kbps", r["write_kbps"])
+            if req.rid: r["req"] = req.rid
+            self.send_tcp_packet((json.dumps(r) + "\n").encode())
+            led_red.off(); led_blue.on()
+
+            start, end = 0, sp.written
+            if self.vad_start >= 0:
+                start = self.vad_start & ~1
+                end = min(sp.written, self.vad_end + VAD_TAIL_BYTES) & ~1
+            header, total_len = self._audio_header(end - start)
+            segs = sp.chunks(self.file_mv, start, end)
+            if self.audio_fmt == "adpcm":
+                self.adpcm_enc.reset()
+                segs = self._adpcm_blocks(segs)
+            yield from self._send_media_slices(self._audio_parts(tag(f"AUD_START:{total_len}\n", req.rid).encode(), header, segs))
+            print("DEBUG [Memo]: Sent")
+        except Exception as e: print("DEBUG [Memo]: Error", e)
+        finally:
+            if self.recording: self.recording = False; audio.stop_streaming()
+            sp.remove()
+            led_red.off(); led_blue.off(); memory.request()
+
+    def _audio_header(self, data_len):
+        if self.audio_fmt == "adpcm":
+            header = adpcm.create_header(data_len // 2, SAMPLE_RATE)
+            return header, len(header) + adpcm.encoded_size(data_len // 2)
+        header = struct.pack('<4sI4s4sIHHIIHH4sI', b'RIFF', 36+data_len, b'WAVE', b'fmt ', 16, 1, 1, SAMPLE_RATE, SAMPLE_RATE*2, 2, 16, b'data', data_len)
+        return header, 44 + data_len
+
+    def _audio_parts(self, start_line, header, segs):
+        yield start_line
+        yield header
+        yield from segs
+
+    def _adpcm_blocks(self, segs):
+        # Encode lazily, one PCM segment per slice; blocks are copied out since out is reused
+        blocks = []
+        for seg in segs:
+            self.adpcm_enc.feed(seg, lambda mv: blocks.append(bytes(mv)))
+            while blocks: yield blocks.pop(0)
+        self.adpcm_enc.flush(lambda mv: blocks.append(bytes(mv)))
+        while blocks: yield blocks.pop(0)
+
+    def _adpcm_body(self, segs, size):
+        # Encode into one RAM buffer so a sequenced transfer can be resumed
+        body = bytearray(size)
+        w = [0]
+        def put(mv):
+            body[w[0]:w[0]+len(mv)] = mv
+            w[0] += len(mv)
+        self.adpcm_enc.reset()
+        for seg in segs: self.adpcm_enc.feed(seg, put)
+        self.adpcm_enc.flush(put)
+        return body
 
     def _audio_callback(self, buf):
         global g_audio_written
         if not self.recording: return
+        tracer.begin(tracer.AUDIO_CB, len(buf))
         mv = memoryview(buf)
         l, off = len(mv), 0
+        buf_start = g_audio_written
         while l > 0:
             if self.rec_idx >= len(g_audio_chunks): self.recording = False; break
             chunk = g_audio_chunks[self.rec_idx]
@@ -291,13 +811,56 @@ class NiclaSystem:
             if self.rec_offset >= AUDIO_CHUNK_SIZE: self.rec_idx += 1; self.rec_offset = 0
         if g_audio_written >= TOTAL_AUDIO_BYTES: self.recording = False
 
-    def send_tcp_packet(self, data):
-        if not self.tcp_conn: return
-        try:
-            self.tcp_conn.setblocking(True)
-            self.tcp_conn.sendall(data)
-            self.tcp_conn.setblocking(False)
-        except: self.tcp_conn.close(); self.tcp_conn = None
+        self._vad(buf, buf_start, g_audio_written, VAD_SILENCE_BYTES)
+        tracer.end(tracer.AUDIO_CB)
+
+    def _memo_callback(self, buf):
+        if not self.recording: return
+        tracer.begin(tracer.AUDIO_CB, len(buf))
+        buf_start = self.spool.written
+        if self.spool.put(buf):
+            if self.spool.written >= self.memo_max_bytes: self.recording = False
+            self._vad(buf, buf_start, self.spool.written, MEMO_SILENCE_BYTES)
+        tracer.end(tracer.AUDIO_CB)
+
+    def _vad(self, buf, buf_start, written, silence):
+        # Energy VAD: stop after `silence` bytes of quiet once voice was heard
+        n = len(buf) >> 1
+        if n >= 4 and _abs_sum(buf, n) // (n >> 2) >= VAD_LEVEL:
+            if self.vad_start < 0: self.vad_start = max(0, buf_start - VAD_PREROLL_BYTES)
+            self.vad_end = written
+        elif self.vad_start >= 0 and written - self.vad_end >= silence:
+            self.recording = False
+
+    def push_stats(self):
+        # Each client has its own STATS:<s> period and its own rate and histogram window
+        if not self.online(): return  # Stats are not worth journaling
+        now = time.ticks_ms()
+        for i in range(len(self.hub.clients) - 1, -1, -1):
+            c = self.hub.clients[i]
+            if not c.stats_ms or time.ticks_diff(now, c.last_stats) < c.stats_ms: continue
+            c.last_stats = now
+            self.send_tcp_packet((json.dumps(metrics.snapshot(reader=c)) + "\n").encode(), c)
+
+    def online(self):
+        # Clients are kept through a WiFi drop, but nothing reaches them until the link is back
+        return self.wifi_up and bool(self.hub.clients)
+
+    def send_tcp_packet(self, data, to=None):
+        if not self.online(): self._journal_event("evt", data); return False
+        tracer.begin(tracer.SEND_TCP, len(data))
+        ok = self.hub.publish(data, SUB_EVENTS, to)
+        tracer.end(tracer.SEND_TCP)
+        return ok
+
+    def send_event(self, key, msg, critical=False):
+        # det / collision: UDP for clients that asked for it, TCP for everyone else
+        if not self.online(): self._journal_event(key, msg); return False
+        self.events.publish(key, msg, critical)
+        return self.hub.publish(msg, SUB_FAST)
+
+    def send_media(self, data):
+        return self.hub.publish(data, SUB_MEDIA)
 
     def _setup_ble_provisioning(self):
         self.ble.irq(self._ble_irq)
@@ -322,64 +885,172 @@ class NiclaSystem:
                 if g_ssid and g_pass: self._save_config(g_ssid, g_pass); self.trigger_wifi_connect = True
 
     def connect_wifi(self):
-        global g_ssid, g_pass, g_wifi_connected
+        global g_ssid, g_pass
         print(f"DEBUG [WiFi]: Connecting to {g_ssid}")
         self.ble.active(False)
-        self.wlan = network.WLAN(network.STA_IF)
-        self.wlan.active(True)
-        self.wlan.connect(g_ssid, g_pass)
-        for _ in range(15):
-            if self.wlan.isconnected(): break
-            led_red.on(); time.sleep_ms(100); led_red.off(); time.sleep_ms(900)
-        if self.wlan.isconnected():
-            g_wifi_connected = True
-            led_green.on()
-            print("DEBUG [WiFi]: IP", self.wlan.ifconfig()[0])
-            self._setup_tcp_server()
-        else:
-            try: uos.remove("wifi.txt")
-            except: pass
+        if not self.link: self.link = wifi_link.WifiLink(led_red)
+        self.server_ready = False
+        self.link.start(g_ssid, g_pass)
+
+    def service_wifi(self):
+        # Association runs in the background; only a hard failure returns to provisioning
+        state = self.link.service()
+        if state == wifi_link.UP:
+            if not self.wifi_up:
+                self.wifi_up = True
+                led_green.on()
+                print("DEBUG [WiFi]: IP", self.link.wlan.ifconfig()[0])
+                if not self.server_ready: self._setup_tcp_server(); self.server_ready = True
+            return True
+        if self.wifi_up: self.wifi_up = False; led_green.off()
+        if state == wifi_link.FAILED:
+            if not self.link.ever_up:
+                try: uos.remove("wifi.txt")
+                except: pass
+                self.link.forget()
+            self.link = None
+            self.hub.close_all()
+            self.discovery.close()
             self.ble.active(True); self._setup_ble_provisioning()
+        return False
 
     def _setup_tcp_server(self):
-        self.server_sock = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
-        self.server_sock.bind(('', TCP_PORT))
-        self.server_sock.listen(1)
-        self.server_sock.setblocking(False)
+        self.hub.listen()
+        self.events.open()
+        self.discovery.close()
+        self.discovery.open()
+        print(f"DEBUG [Disc]: id {self.discovery.device_id}")
 
     def manage_connection(self):
-        if not self.tcp_conn:
+        c = self.hub.accept()
+        if c:
+            c.rx = LineParser()
+            if not self.first_conn: self.first_conn = True; self._ready("first_conn")
+        if c and len(self.hub.clients) == 1:
+            self.connection_time = time.ticks_ms()
+            self.sent_initial_bat = False
+            self.low_bat_warned = False
+            self.last_tof_zone = b"clear"
+        if c and self.journal.total():
+            # Offline history is waiting; the app pulls it with JOURNAL when it is ready
+            self.send_tcp_packet(('{"type":"journal","bytes":%d}\n' % self.journal.total()).encode(), c)
+        if self.hub.check_health(): self.discovery.kick()
+        p = self.hub.clients[0] if self.hub.clients else None
+        if p is not self.primary:
+            # Media framing is shared by every client, so it follows the primary and starts over with
+            # the legacy defaults when a new one takes that role
+            self.primary = p
+            self.audio_fmt, self.xfer_mode = "pcm", False
+        self.discovery.service(len(self.hub.clients) < self.hub.max_clients)
+        if not self.hub.clients: return False
+
+        self.hub.pump()
+        self.events.service()
+        for i in range(len(self.hub.clients) - 1, -1, -1):
+            client = self.hub.clients[i]
+            # read_from() already returns None for EAGAIN, so any OSError here (ECONNRESET,
+            # ETIMEDOUT...) means the connection is dead, same as EOF
+            try: n = client.rx.read_from(client.sock)
+            except OSError as e: print("DEBUG [TCP]: Read failed", e); n = 0
+            if n == 0: self.hub.close(client); self.discovery.kick(); continue
+            if not n: continue
+            self.hub.received(client, n)
             try:
-                conn, addr = self.server_sock.accept()
-                conn.setblocking(False)
-                self.tcp_conn = conn
-                self.connection_time = time.ticks_ms()
-                self.sent_initial_bat = False
-                self.low_bat_warned = False
-                self.last_tof_zone = "clear"
-                print("DEBUG [TCP]: Connected")
-            except:
-                if time.ticks_diff(time.ticks_ms(), self.last_broadcast) > 2000:
-                    try:
-                        u = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
-                        u.sendto(b"NICLA_READY", (UDP_IP, UDP_DISC_PORT))
-                        u.close()
-                    except: pass
-                    self.last_broadcast = time.ticks_ms()
-            return False
+                l = client.rx.next_line()
+                while l is not None:
+                    if l: self._handle_command(l, client)
+                    l = client.rx.next_line()
+            except Exception as e: print("DEBUG [TCP]: Command error", e)  # One bad command must not stall the loop
+        return bool(self.hub.clients)
 
-        try:
-            d = self.tcp_conn.recv(128)
-            if d:
-                lines = d.decode().strip().split('\n')
-                for l in lines:
-                    c = l.strip()
-                    if c == "take_picture": self.req_image = True
-                    elif c == "RECORD": self.req_audio = True
-                    elif c == "ping": self.send_tcp_packet(b"pong\n")
-            elif d == b'': self.tcp_conn.close(); self.tcp_conn = None
-        except: pass
-        return True
+    def _handle_command(self, line, client):
+        # Commands may end in " #<id>"; the ID comes back on the reply
+        c, rid = split_id(line)
+        reply = lambda t: self.send_tcp_packet(tag(t, rid).encode(), client)
+        # Captures queue; " !<n>" before the ID overrides the priority, lower goes first
+        c, prio = split_prio(c, PRIO_AUDIO if c.startswith("RECORD") else PRIO_IMAGE)
+        kind = "img" if c.startswith("take_picture") else "memo" if c.startswith("RECORD_MEMO") else "aud" if c == "RECORD" else None
+        if kind and self._unavailable(kind): reply(c.split(":")[0] + ":unavailable\n"); return
+        ok = True
+        if c == "take_picture": ok = self._want_picture(rid, prio)
+        elif c == "take_picture_roi" or c.startswith("take_picture_roi:"):
+            # take_picture_roi[:<pad cells>] sends only the area around the last detection; IMG_START gets ,<x>,<y>,<w>,<h>
+            try: pad = int(c[17:]) if len(c) > 17 else ROI_PAD
+            except ValueError: pad = ROI_PAD
+            ok = self._want_picture(rid, prio, roi=max(pad, 0))
+        elif c == "take_picture_prog":
+            # THUMB_START:<size>,<capture>, then IMG_START:<size>,<capture> for the full frame of the same snapshot
+            ok = self._want_picture(rid, prio, thumb=True)
+        elif c == "take_picture_doc" or c == "take_picture_doc:crop":
+            # Grayscale at the largest frame that fits, contrast-normalised; :crop also cuts to the page
+            ok = self._want_picture(rid, prio, doc=2 if c.endswith(":crop") else 1)
+        elif c == "take_picture_burst" or c.startswith("take_picture_burst:"):
+            # take_picture_burst[:<frames>] sends only the sharpest; IMG_START gets ,<sharpness>,<ms>,<frames>
+            try: n = int(c[19:]) if len(c) > 19 else BURST_FRAMES
+            except ValueError: n = BURST_FRAMES
+            ok = self._want_picture(rid, prio, burst=min(max(n, 2), BURST_MAX))
+        elif c == "RECORD": ok = self.captures.push("aud", rid, prio) is not None
+        elif c == "RECORD_MEMO" or c.startswith("RECORD_MEMO:"):
+            # RECORD_MEMO[:<seconds>] spools to flash; RECORD_STOP or a long silence ends it
+            if not self.spool: reply("RECORD_MEMO:unavailable\n")
+            else:
+                try: secs = int(c[12:]) if len(c) > 12 else MEMO_MAX_S
+                except ValueError: secs = MEMO_MAX_S
+                ok = self.captures.push("memo", rid, prio, SAMPLE_RATE * 2 * max(1, secs)) is not None
+        elif c.startswith("CANCEL:"):
+            # CANCEL:<id> drops that capture request, CANCEL:* every queued one; replies with how many went
+            reply("CANCEL:%s,%d\n" % (c[7:], self._cancel(c[7:])))
+        elif c == "RECORD_STOP": self.recording = False
+        elif c == "ping": self.send_tcp_packet(b"pong\n" if not rid else tag("pong\n", rid).encode(), client)
+        elif c == "pong": self.hub.pong(client)
+        elif c == "health":
+            h = self.hub.stats()
+            h["type"] = "health"
+            if rid: h["req"] = rid
+            if self.link: h["wifi_connect_ms"], h["wifi_reconnects"] = self.link.connect_ms, self.link.reconnects
+            h["boot_ms"] = self.boot_ms
+            h["queued"] = len(self.captures.items)
+            self.send_tcp_packet((json.dumps(h) + "\n").encode(), client)
+        elif c == "stats" or c == "stats full":
+            s = metrics.snapshot(c == "stats full", client)
+            if rid: s["req"] = rid
+            self.send_tcp_packet((json.dumps(s) + "\n").encode(), client)
+        elif c == "mem":
+            m = memory.report()
+            if rid: m["req"] = rid
+            self.send_tcp_packet((json.dumps(m) + "\n").encode(), client)
+        elif c == "JOURNAL": self.req_journal = client
+        elif c == "JOURNAL_ACK": self.journal.clear(); reply("JOURNAL_ACK\n")
+        elif c == "bench_cam": self.req_bench = client
+        elif c == "trace": self.req_trace = client
+        elif c == "trace clear": tracer.clear(); reply("trace:cleared\n")
+        elif c.startswith("STATS:"):
+            # STATS:<seconds> starts periodic pushes, STATS:0 stops them
+            try: client.stats_ms = max(0, int(c[6:])) * 1000
+            except ValueError: pass
+            reply(f"STATS:{client.stats_ms // 1000}\n")
+        elif c.startswith("AUDIO_FMT:"):
+            # Framing commands from secondary clients are answered with the setting left unchanged
+            fmt = c[10:]
+            if fmt in ("pcm", "adpcm") and client is self.primary: self.audio_fmt = fmt
+            reply(f"AUDIO_FMT:{self.audio_fmt}\n")
+        elif c.startswith("XFER:"):
+            if client is self.primary: self.xfer_mode = c[5:] == "on"
+            reply("XFER:on\n" if self.xfer_mode else "XFER:off\n")
+        elif c.startswith("SUB:"):
+            subs = {"events": SUB_EVENTS | SUB_FAST, "media": SUB_MEDIA, "all": SUB_ALL}.get(c[4:])
+            if subs: client.subs = subs if not client.udp_port else subs & ~SUB_FAST
+            reply(f"SUB:{c[4:] if subs else 'invalid'}\n")
+        elif c.startswith("UDP_EVENTS:"):
+            # UDP_EVENTS:<port> moves det/collision for this client to datagrams, 0 = back to TCP
+            try: client.udp_port = int(c[11:])
+            except ValueError: client.udp_port = 0
+            client.udp_addr = (client.addr[0], client.udp_port)  # Built once, not per datagram
+            if client.udp_port: client.subs &= ~SUB_FAST
+            else: client.subs |= SUB_FAST if client.subs & SUB_EVENTS else 0
+            reply(f"UDP_EVENTS:{client.udp_port}\n")
+        else: self.outbox.handle(c, lambda b: self.hub.publish(b, SUB_MEDIA, client))
+        if not ok: reply("BUSY:%d\n" % len(self.captures.items))  # Capture queue full; nothing was queued
 
     def _save_config(self, s, p):
         try:
@@ -395,18 +1066,22 @@ class NiclaSystem:
 
 nicla = NiclaSystem()
 while True:
+    metrics.inc("loop")
+    if nicla.boot: nicla.step_boot()
     if nicla.trigger_wifi_connect:
         nicla.trigger_wifi_connect = False
         nicla.connect_wifi()
-    if g_wifi_connected:
-        if not nicla.wlan.isconnected():
-            g_wifi_connected = False
-            nicla.ble.active(True); nicla._setup_ble_provisioning()
-        else:
-            if nicla.manage_connection():
-                nicla.check_imu()
-                nicla.check_tof()
-                if nicla.req_image: nicla.process_image()
-                elif nicla.req_audio: nicla.process_audio()
-                else: nicla.run_active_detection()
-    time.sleep_ms(10)
+    if nicla.link:
+        if nicla.service_wifi():
+            nicla.outbox.expire()
+            nicla.manage_connection()
+        # Sensing continues through WiFi drops and with no app attached; events go to the journal
+        nicla.check_imu()
+        nicla.check_tof()
+        nicla.run_jobs()
+        nicla.push_stats()
+    nicla.journal.service()
+    if not nicla.job:
+        memory.idle()
+        if nicla.link and not nicla.hub.clients: nicla.link.idle()  # Nobody waiting on the loop
+    time.sleep_ms(1 if nicla.job or nicla.tx else 10)  # Busy passes only yield to the WiFi stack
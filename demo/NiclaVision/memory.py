@@ -0,0 +1,74 @@
+import gc
+import time
+import metrics
+import tracer
+
+# Budgeted collection: the frame and transfer paths never call gc.collect() directly.
+# They call request() after dropping large objects, and the main loop calls idle() in
+# its slack. gc.threshold is a safety net so an automatic collection happens well
+# before an allocation fails on a fragmented heap, which is the slowest kind.
+THRESHOLD_DIV = 4           # Automatic collection after heap/4 bytes of new allocations
+IDLE_ALLOC_BYTES = 8192     # Idle slots collect once this much was allocated since the last one
+IDLE_MAX_MS = 5000          # ...or at least this often
+
+_last_ms = 0
+_live = 0                   # gc.mem_alloc() right after the last collection
+_wanted = False
+collections = 0
+pause_max_us = 0
+pause_total_us = 0
+
+def init():
+    heap = gc.mem_free() + gc.mem_alloc()
+    collect()
+    gc.threshold(heap // THRESHOLD_DIV)
+    print(f"DEBUG [Mem]: heap {heap}, free {gc.mem_free()}, threshold {heap // THRESHOLD_DIV}")
+
+def collect():
+    global _last_ms, _live, _wanted, collections, pause_max_us, pause_total_us
+    tracer.begin(tracer.GC)
+    t0 = time.ticks_us()
+    gc.collect()
+    dt = time.ticks_diff(time.ticks_us(), t0)
+    tracer.end(tracer.GC, dt)
+    metrics.observe("gc_ms", dt // 1000)
+    collections += 1
+    pause_total_us += dt
+    if dt > pause_max_us: pause_max_us = dt
+    _last_ms = time.ticks_ms()
+    _live = gc.mem_alloc()
+    _wanted = False
+
+def request():
+    # Large buffers were just released; reclaim them in the next idle slot
+    global _wanted
+    _wanted = True
+
+def idle():
+    # Collect only when it is worth a pause; True if it did
+    if _wanted or gc.mem_alloc() - _live > IDLE_ALLOC_BYTES or time.ticks_diff(time.ticks_ms(), _last_ms) > IDLE_MAX_MS:
+        collect()
+        return True
+    return False
+
+def largest_free():
+    # Largest single allocation that succeeds, found by trial; slow, for reports only
+    lo, hi = 0, gc.mem_free()
+    while hi - lo > 256:
+        mid = (lo + hi) // 2
+        gc.collect()  # Free the previous probe
+        try:
+            b = bytearray(mid)
+            lo = mid
+        except MemoryError: hi = mid
+        b = None
+    gc.collect()
+    return lo
+
+def report():
+    collect()
+    free = gc.mem_free()
+    big = largest_free()
+    return {"type": "mem", "free": free, "alloc": gc.mem_alloc(), "largest": big,
+            "frag": round(1 - big / free, 2) if free else 0, "gc": collections,
+            "pause_max_us": pause_max_us, "pause_avg_us": pause_total_us // collections if collections else 0}
@@ -0,0 +1,82 @@
+import time
+import gc
+
+# Process-wide registry. Modules call inc()/gauge()/observe() on the hot path: one dict
+# lookup and an int add, no allocation once a name exists. snapshot() builds the report.
+# Counters and histograms only ever grow; each reader keeps its own baseline, so one
+# client polling "stats" does not shorten the window another client's pushes report.
+MS_BUCKETS = (1, 2, 5, 10, 20, 50, 100, 200, 500, 1000)  # Upper bounds; one overflow bucket after
+
+_counters = {}
+_gauges = {}
+_hists = {}        # name -> [bounds, counts, total, max since boot]
+_readers = {}      # reader -> [ticks at its last snapshot, counter values, {hist: [counts, total]}]
+_boot_t = time.ticks_ms()
+
+def inc(name, n=1):
+    try: _counters[name] += n
+    except KeyError: _counters[name] = n
+
+def gauge(name, value):
+    _gauges[name] = value
+
+def observe(name, value, bounds=MS_BUCKETS):
+    h = _hists.get(name)
+    if h is None: h = _hists[name] = [bounds, [0] * (len(bounds) + 1), 0, 0]
+    i, b = 0, h[0]
+    while i < len(b) and value > b[i]: i += 1
+    h[1][i] += 1
+    h[2] += value
+    if value > h[3]: h[3] = value
+
+def since(name, t0):
+    # observe() the ms elapsed since a time.ticks_ms() stamp
+    observe(name, time.ticks_diff(time.ticks_ms(), t0))
+
+def forget(reader):
+    # Drop a reader's baseline, e.g. when its client disconnects
+    _readers.pop(reader, None)
+
+def get(name):
+    return _counters.get(name, 0)
+
+def _quantile(h, q):
+    # Upper bound of the bucket holding the q-th sample; the overflow bucket reports max
+    n = sum(h[1])
+    if not n: return 0
+    want, acc = n * q, 0
+    for i, c in enumerate(h[1]):
+        acc += c
+        if acc >= want: return h[0][i] if i < len(h[0]) else h[3]
+    return h[3]
+
+def snapshot(full=False, reader=None):
+    # Compact dict: cumulative counters, gauges, and for the window since this reader's
+    # last snapshot (since boot on its first) per-second rates and histograms as
+    # [count, avg, p50, p95, max] (plus bounds and raw buckets when full). max is the
+    # highest bucket bound hit in the window, or the true maximum when that is lower.
+    now = time.ticks_ms()
+    base = _readers.get(reader)
+    if base is None: base = _readers[reader] = [_boot_t, {}, {}]
+    dt = max(1, time.ticks_diff(now, base[0]))
+    prev, hprev = base[1], base[2]
+    rates = {}
+    for k, v in _counters.items():
+        d = v - prev.get(k, 0)
+        if d: rates[k] = round(d * 1000 / dt, 1)
+        prev[k] = v
+    base[0] = now
+    hists = {}
+    for k, h in _hists.items():
+        p = hprev.get(k)
+        if p is None: p = hprev[k] = [[0] * len(h[1]), 0]
+        counts = [c - p[0][i] for i, c in enumerate(h[1])]
+        top = len(counts) - 1
+        while top > 0 and not counts[top]: top -= 1
+        w = [h[0], counts, h[2] - p[1], min(h[3], h[0][top]) if top < len(h[0]) else h[3]]
+        n = sum(counts)
+        hists[k] = [n, w[2] // n if n else 0, _quantile(w, 0.5), _quantile(w, 0.95), w[3] if n else 0]
+        if full: hists[k] += [h[0], counts]
+        p[0], p[1] = list(h[1]), h[2]
+    return {"type": "stats", "up": time.ticks_diff(now, _boot_t) // 1000, "mem_free": gc.mem_free(),
+            "c": _counters, "r": rates, "g": _gauges, "h": hists}
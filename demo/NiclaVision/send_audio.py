@@ -5,6 +5,9 @@ import uos
 import bluetooth
 import gc
 import micropython
+import adpcm
+from ble_transfer import BulkSender
+import memory
 from pyb import LED
 
 # Emergency buffer for interrupts
@@ -81,17 +84,18 @@ def record_to_ram():
     led_green.off()
     led_blue.off()
 
-    gc.collect()
-    g_chunks = []
-    gc.collect()
-
-    print(f"Allocating RAM...")
-    try:
-        for i in range(NUM_CHUNKS):
-            g_chunks.append(bytearray(CHUNK_SIZE))
-    except MemoryError:
-        print("MemErr")
-        led_red.off(); return False
+    if len(g_chunks) != NUM_CHUNKS:
+        # Allocated once and reused by every take, so the heap does not fragment
+        g_chunks = []
+        memory.collect()
+        print(f"Allocating RAM...")
+        try:
+            for i in range(NUM_CHUNKS):
+                g_chunks.append(bytearray(CHUNK_SIZE))
+        except MemoryError:
+            print("MemErr")
+            g_chunks = []
+            led_red.off(); return False
 
     try: audio.init(channels=CHANNELS, frequency=SAMPLE_RATE, gain_db=18, highpass=0.9883)
     except: print("FreqErr"); led_red.off(); return False
@@ -123,7 +127,8 @@ class BLEApp:
         self.conn = None
         self.start_transfer = False
         self.start_recording = False
-        self.payload_size = 20
+        self.tx = BulkSender(self.ble)
+        self.audio_fmt = "pcm"
         self.ble.gap_advertise(100000, adv_data=bytearray(b'\x02\x01\x06') + bytearray([len(BLE_DEVICE_NAME)+1, 9]) + BLE_DEVICE_NAME)
         led_green.on()
         print("Advertising...")
@@ -131,6 +136,7 @@ class BLEApp:
     def _irq(self, event, data):
         if event == 1:
             self.conn = data[0]
+            self.tx.connected(self.conn)
             led_green.off()
             print("Connected.")
         elif event == 2:
@@ -139,7 +145,8 @@ class BLEApp:
             led_blue.off()
             led_green.on()
             print("Disconnected.")
-            self.payload_size = 20
+            self.tx.disconnected()
+            self.audio_fmt = "pcm"
             self.ble.gap_advertise(100000, adv_data=bytearray(b'\x02\x01\x06') + bytearray([len(BLE_DEVICE_NAME)+1, 9]) + BLE_DEVICE_NAME)
         elif event == 3:
             if data[1] == self.h_rx:
@@ -149,24 +156,33 @@ class BLEApp:
                         self.start_transfer = True
                     elif cmd == "RECORD":
                         self.start_recording = True
+                    elif cmd.startswith("AUDIO_FMT:") and cmd[10:] in ("pcm", "adpcm"):
+                        self.audio_fmt = cmd[10:]
                 except: pass
         elif event == 21:
             mtu = data[1]
-            self.payload_size = mtu - 3
+            self.tx.mtu_exchanged(mtu)
             print(f"MTU: {mtu}")
 
     def send_ram_data(self):
         print("Streaming...")
         led_blue.on()
         self.start_transfer = False
-        gc.collect()
 
         try:
-            total_size = 44 + g_total_written
+            self.tx.begin()
+            if self.audio_fmt == "adpcm":
+                header = adpcm.create_header(g_total_written // 2, SAMPLE_RATE)
+                total_size = len(header) + adpcm.encoded_size(g_total_written // 2)
+                enc = adpcm.Encoder()
+                emit = lambda mv: enc.feed(mv, self.send)
+            else:
+                header = create_wav_header(g_total_written)
+                total_size = 44 + g_total_written
+                emit = self.send
             self.send(f"START:{total_size}\n".encode())
             time.sleep_ms(100) # Wait for phone to prep buffer
 
-            header = create_wav_header(g_total_written)
             self.send(header)
 
             for i in range(g_curr_chunk_idx + 1):
@@ -178,39 +194,24 @@ class BLEApp:
                     data_len = g_curr_chunk_offset
 
                 if data_len > 0:
-                    self.send(memoryview(chunk)[:data_len])
-
-                g_chunks[i] = None
-                if i % 5 == 0: gc.collect()
+                    emit(memoryview(chunk)[:data_len])
 
-            if self.conn:
-                self.ble.gatts_notify(self.conn, self.h_tx, b"END\n")
+            if self.audio_fmt == "adpcm": enc.flush(self.send)
+            self.send(b"END\n")
+            self.tx.report("Audio")
             print("Sent.")
 
         except Exception as e:
             print(f"SendErr: {e}")
         finally:
             led_blue.off()
-            gc.collect()
+            memory.request()
 
     def send(self, data):
-        mv = memoryview(data)
-        bytes_sent = 0
-        total_len = len(data)
-
-        while bytes_sent < total_len:
-            if not self.conn: break
-            chunk_len = min(self.payload_size, total_len - bytes_sent)
-            try:
-                self.ble.gatts_notify(self.conn, self.h_tx, mv[bytes_sent : bytes_sent + chunk_len])
-                bytes_sent += chunk_len
-            except OSError:
-                pass # Buffer full, just retry logic implies wait
-
-            # Increased delay to 35ms to prevent packet loss
-            time.sleep_ms(15)
+        return self.tx.send(self.h_tx, data)
 
 if __name__ == "__main__":
+    memory.init()
     if record_to_ram():
         app = BLEApp()
         while True:
@@ -220,4 +221,5 @@ if __name__ == "__main__":
                 if app.conn: app.ble.gap_disconnect(app.conn)
                 time.sleep_ms(1000)
                 record_to_ram()
+            memory.idle()
             time.sleep_ms(100)
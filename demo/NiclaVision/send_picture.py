@@ -3,8 +3,10 @@ import time
 import struct
 import sensor
 import image
-import gc
 import uos
+from ble_transfer import BulkSender
+from transfer import Outbox
+import memory
 
 _NICLA_SERVICE_UUID_STR = "12345678-1234-5678-1234-567890ABCDEF"
 _NICLA_SERVICE_UUID = bluetooth.UUID(_NICLA_SERVICE_UUID_STR)
@@ -33,11 +35,13 @@ class BLEPeripheral:
         self.is_connected = False
         self.adv_payload = b''
         self.stream_enabled = True
+        self.tx = BulkSender(self.ble)
+        self.xfer_mode = False
+        self.outbox = Outbox(self.send_data)
 
         self._init_camera()
         self.setup_ble()
-
-        gc.collect()
+        memory.init()
 
     def _init_camera(self):
         try:
@@ -74,23 +78,27 @@ class BLEPeripheral:
         elif command_lower == "start stream":
             self.stream_enabled = True
             print("Action: Resuming image stream.")
+        elif command_lower in ("xfer on", "xfer off"):
+            self.xfer_mode = command_lower == "xfer on"
+            print(f"Action: Sequenced transfers {'on' if self.xfer_mode else 'off'}.")
+        elif self.outbox.handle(command):
+            self.outbox.flush()
         elif command_lower == "take_picture" and self.is_connected:
             print("Action: Capturing and sending single picture...")
             self.capture_and_send_image()
         else:
             print(f"Unknown command or not connected: {command}")
 
-        gc.collect()
-
     def _irq(self, event, data):
         if event == 1:
             self.conn_handle, addr_type, addr = data
+            self.tx.connected(self.conn_handle)
             self.is_connected = True
             self.stream_enabled = True
             print(f"Connected to central: {addr}")
-            gc.collect()
         elif event == 2:
             self.conn_handle = None
+            self.tx.disconnected()
             self.is_connected = False
             self.stream_enabled = False
             print("Disconnected from central.")
@@ -105,47 +113,43 @@ class BLEPeripheral:
                     self.handle_command(command)
                 except UnicodeError:
                     print("Received non-text command data.")
-            gc.collect()
+        elif event == 21:
+            self.tx.mtu_exchanged(data[1])
+            print(f"MTU: {data[1]}")
 
     def send_data(self, data: bytes):
         if self.conn_handle is not None and self.data_handle is not None:
-            CHUNK_SIZE = 20
-
-            for i in range(0, len(data), CHUNK_SIZE):
-                chunk = data[i:i + CHUNK_SIZE]
-                self.ble.gatts_notify(self.conn_handle, self.data_handle, chunk)
-                time.sleep_ms(8)
-        else:
-            pass
+            return self.tx.send(self.data_handle, data)
+        return False
 
     def capture_and_send_image(self):
         FILE_PATH = "temp_image.jpg"
 
         try:
             img = sensor.snapshot()
+            if self.xfer_mode:
+                jpg = img.to_jpeg(quality=75, copy=True)
+                self.tx.begin()
+                self.outbox.start("img", [jpg.bytearray()], jpg)
+                self.outbox.flush()
+                self.tx.report("Image")
+                return
             # OPTIMIZATION 1: Drastically lowered quality to reduce file size (and thus, packet count)
             img.save(str(FILE_PATH), quality=75)
 
             del img
-            gc.collect()
+            memory.request()
 
             with open(FILE_PATH, 'rb') as f:
                 file_size = f.seek(0, 2)
                 f.seek(0)
                 print(f"Captured JPEG (QVGA, Q75) saved to flash: {file_size} bytes. Sending...")
 
+                self.tx.begin()
                 self.send_data(START_SEQUENCE)
-
-                while True:
-                    read_chunk = f.read(128)
-                    if not read_chunk:
-                        break
-
-                    self.send_data(read_chunk)
-                    # OPTIMIZATION 2: Increased outer delay to 20ms
-                    time.sleep_ms(20)
-
-                self.send_data(END_SEQUENCE)
+                if self.tx.send_file(self.data_handle, f):
+                    self.send_data(END_SEQUENCE)
+                self.tx.report("Image")
                 print("Image transmission complete.")
 
             uos.remove(FILE_PATH)
@@ -153,7 +157,7 @@ class BLEPeripheral:
 
         except Exception as e:
             print(f"Image transfer error: {e}")
-            gc.collect()
+            memory.request()
 
 
 if __name__ == "__main__":
@@ -184,5 +188,6 @@ if __name__ == "__main__":
               connection_time = 0
               last_send_time = 0
 
-        gc.collect()
+        nicla_ble.outbox.expire()
+        memory.idle()
         time.sleep_ms(50)
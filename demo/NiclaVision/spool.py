@@ -0,0 +1,111 @@
+import time
+import uos
+
+# Long recordings: the audio callback copies PCM into a small ring of fixed buffers and
+# the main loop writes full ones to a file, so a take's length is bounded by storage,
+# not RAM. The callback only bumps `produced` and the writer only bumps `consumed`,
+# which keeps the hand-over safe without disabling IRQs.
+SPOOL_BUF = 4096            # 128 ms of 16 kHz mono PCM per buffer
+SPOOL_BUFS = 4              # One filling, the rest absorb flash write stalls
+SPOOL_FILE = "memo.pcm"
+
+def _pick_path():
+    # The SD card is much faster than internal flash when it is there
+    try:
+        uos.stat("/sd")
+        return "/sd/" + SPOOL_FILE
+    except OSError: return SPOOL_FILE
+
+class AudioSpool:
+    def __init__(self, nbufs=SPOOL_BUFS, size=SPOOL_BUF):
+        self.bufs = [bytearray(size) for _ in range(nbufs)]
+        self.mvs = [memoryview(b) for b in self.bufs]
+        self.size = size
+        self.path = None
+        self.f = None
+        self.reset()
+
+    def reset(self):
+        self.produced = 0       # Buffers filled by the callback
+        self.consumed = 0       # Buffers written to the file
+        self.fill = 0           # Bytes in the buffer being filled
+        self.written = 0        # Bytes accepted from the callback = file offset of the next byte
+        self.dropped = 0        # Callback buffers lost because every spool buffer was full
+        self.flushed = 0        # Bytes written to the file
+        self.write_ms = 0       # Time spent inside f.write
+        self.t0 = time.ticks_ms()
+
+    def open(self, path=None):
+        self.close()
+        self.path = path or _pick_path()
+        self.f = open(self.path, "wb")
+        self.reset()
+
+    def put(self, buf):
+        # Callback context: copy only. False if the buffer had to be dropped.
+        n = len(buf)
+        nb = len(self.bufs)
+        need = 2 if self.fill + n > self.size else 1  # Buffers this copy touches
+        if self.produced - self.consumed + need > nb:
+            self.dropped += 1
+            return False
+        mv = memoryview(buf)
+        off = 0
+        while off < n:
+            amt = min(n - off, self.size - self.fill)
+            self.mvs[self.produced % nb][self.fill:self.fill + amt] = mv[off:off + amt]
+            self.fill += amt
+            off += amt
+            if self.fill == self.size:
+                self.fill = 0
+                self.produced += 1
+        self.written += n
+        return True
+
+    def service(self):
+        # Write at most one full buffer; True if more are waiting
+        if self.consumed == self.produced: return False
+        self._write(self.mvs[self.consumed % len(self.bufs)])
+        self.consumed += 1
+        return self.consumed != self.produced
+
+    def finish(self):
+        # After audio.stop_streaming(): drain the ring and the partial buffer, then close
+        while self.service(): pass
+        if self.fill: self._write(self.mvs[self.produced % len(self.bufs)][:self.fill])
+        self.f.close()
+        self.f = None
+        return self.report()
+
+    def report(self):
+        ms = max(1, time.ticks_diff(time.ticks_ms(), self.t0))
+        return {"type": "memo", "bytes": self.written, "ms": ms, "dropped": self.dropped,
+                "write_kbps": self.flushed // max(1, self.write_ms), "write_busy": round(self.write_ms / ms, 2)}
+
+    def chunks(self, mv, start, end):
+        # Stream file bytes [start, end) through the caller's buffer; each view is valid until the next one
+        with open(self.path, "rb") as f:
+            f.seek(start)
+            while start < end:
+                n = f.readinto(mv[:min(len(mv), end - start)])
+                if not n: break
+                start += n
+                yield mv[:n]
+
+    def close(self):
+        if self.f:
+            try: self.f.close()
+            except OSError: pass
+            self.f = None
+
+    def remove(self):
+        self.close()
+        if self.path:
+            try: uos.remove(self.path)
+            except OSError: pass
+
+    def _write(self, mv):
+        t0 = time.ticks_ms()
+        self.f.write(mv)
+        self.write_ms += time.ticks_diff(time.ticks_ms(), t0)
+        self.flushed += len(mv)
@@ -0,0 +1,245 @@
+import socket
+import select
+import time
+import errno
+import metrics
+
+SUB_EVENTS = 1      # JSON events and command replies
+SUB_MEDIA = 2       # IMG_START / AUD_START / XFER_* payloads
+SUB_FAST = 4        # det / collision over TCP; cleared once a client takes them over UDP
+SUB_ALL = SUB_EVENTS | SUB_MEDIA | SUB_FAST
+_TX_METRIC = {SUB_EVENTS: "tx_events", SUB_MEDIA: "tx_media", SUB_FAST: "tx_fast"}
+
+MAX_CLIENTS = 4
+QUEUE_LIMIT = 16384     # Bytes a client may have waiting before we hold back
+MEDIA_STALL_MS = 5000   # A media subscriber that makes no room this long is dropped
+MAX_PARKED = 16         # Events parked per client during one raw payload
+HEARTBEAT_MS = 3000     # Ping a client that has been quiet this long
+DEAD_PEER_MS = 10000    # Silence after which a client that answers our pings is gone
+LEGACY_DEAD_MS = 25000  # Older apps ignore our pings but send their own every 10 s
+SEND_TIMEOUT_MS = 4000  # Queued data that makes no progress this long means a dead link
+
+class Client:
+    def __init__(self, sock, addr):
+        self.sock = sock
+        self.addr = addr
+        self.subs = SUB_ALL
+        self.queue = []     # memoryviews over immutable copies, oldest first
+        self.queued = 0
+        self.dropped = 0
+        self.udp_port = 0   # Set when the client asked for UDP events
+        self.udp_addr = None
+        self.parked = []    # Events parked while a raw media payload is in flight
+        self.parked_t = 0   # When the first of them was parked
+        self.rx = None      # Line parser for incoming commands, attached by the owner
+        self.stats_ms = 0   # STATS:<s> push period for this client, 0 = off
+        self.last_stats = 0
+        self.full_since = 0
+        now = time.ticks_ms()
+        self.last_rx = now
+        self.last_tx = now  # Last time queued bytes left, or the queue started filling
+        self.hb_sent = now
+        self.hb_ok = False  # Answered one of our pings
+        self.rtt_ms = -1
+        self.bytes_tx = 0
+        self.bytes_rx = 0
+
+    def try_send(self, mv):
+        # Non-blocking send; bytes written, 0 if the socket is full, -1 if it is dead
+        try:
+            n = self.sock.send(mv)
+            if not n: return 0
+            self.bytes_tx += n
+            self.last_tx = time.ticks_ms()
+            return n
+        except OSError as e:
+            return 0 if e.args[0] == errno.EAGAIN else -1
+
+    def flush(self):
+        while self.queue:
+            mv = self.queue[0]
+            n = self.try_send(mv)
+            if n < 0: return False
+            self.queued -= n
+            if n < len(mv):
+                self.queue[0] = mv[n:]
+                return True
+            self.queue.pop(0)
+        return True
+
+class TcpHub:
+    # Several TCP clients; each message is encoded once by the caller and fanned out.
+    # Clients with an empty queue are written directly; the rest share one copy.
+    def __init__(self, port, max_clients=MAX_CLIENTS):
+        self.port = port
+        self.max_clients = max_clients
+        self.server = None
+        self.poller = None
+        self.clients = []
+        self.raw_open = False
+        self.raw_to = None      # Client receiving a private raw payload
+        self.connects = 0
+        self.dead_rx = 0    # Dropped for silence
+        self.dead_tx = 0    # Dropped because sends stopped draining
+
+    def listen(self):
+        if self.server:
+            self.close_all()
+            self.server.close()
+        self.server = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+        try: self.server.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+        except: pass
+        self.server.bind(('', self.port))
+        self.server.listen(self.max_clients)
+        self.server.setblocking(False)
+        self.poller = select.poll()
+        self.poller.register(self.server, select.POLLIN)
+
+    def accept(self):
+        # Poll first so an idle pass costs no exception
+        if not self.server or len(self.clients) >= self.max_clients: return None
+        if not self.poller.poll(0): return None
+        try: conn, addr = self.server.accept()
+        except OSError: return None
+        conn.setblocking(False)
+        c = Client(conn, addr)
+        self.clients.append(c)
+        self.connects += 1
+        print(f"DEBUG [TCP]: Client {addr[0]} ({len(self.clients)})")
+        return c
+
+    def close(self, c):
+        try: c.sock.close()
+        except: pass
+        if c in self.clients: self.clients.remove(c)
+        metrics.forget(c)  # Its stats window
+        print(f"DEBUG [TCP]: Client {c.addr[0]} gone ({len(self.clients)})")
+
+    def close_all(self):
+        for i in range(len(self.clients) - 1, -1, -1): self.close(self.clients[i])
+
+    def publish(self, data, kind=SUB_EVENTS, to=None):
+        # to= sends a reply to one client regardless of its subscriptions
+        mv = data if type(data) is memoryview else memoryview(data)  # Encoder views pass straight through
+        held = None
+        if to is not None:
+            if to in self.clients: held = self._offer(to, mv, kind, held)
+        else:
+            for i in range(len(self.clients) - 1, -1, -1):
+                c = self.clients[i]
+                if c.subs & kind: held = self._offer(c, mv, kind, held)
+        if self.clients: metrics.inc(_TX_METRIC[kind], len(mv))
+        return bool(self.clients)
+
+    def begin_raw(self, to=None):
+        # IMG_START/AUD_START payloads have no framing; park other messages until end_raw().
+        # to= covers a payload sent to one client only, whatever it subscribed to.
+        if to is None: self.raw_open = True
+        else: self.raw_to = to
+
+    def end_raw(self):
+        self.raw_open = False
+        self.raw_to = None
+        now = time.ticks_ms()
+        for i in range(len(self.clients) - 1, -1, -1):
+            c = self.clients[i]
+            parked, c.parked = c.parked, []
+            # How long an event was really held back, which is what a legacy app's alert latency is
+            if parked: metrics.observe("parked_ms", time.ticks_diff(now, c.parked_t))
+            for data in parked: self._offer(c, memoryview(data), SUB_EVENTS, data)
+
+    def ready(self, kind, n):
+        # True when the primary (oldest) client can queue n more bytes right now, so only it
+        # sets the pace. A secondary subscriber that cannot take n more is closed rather than
+        # waited for; it reconnects and picks up the next payload. Lets sliced senders yield
+        # instead of blocking; a primary stuck for MEDIA_STALL_MS is dropped too.
+        ok, now = True, time.ticks_ms()
+        for i in range(len(self.clients) - 1, -1, -1):
+            c = self.clients[i]
+            if not c.subs & kind or not c.queued or c.queued + n <= QUEUE_LIMIT:
+                c.full_since = 0
+            elif i:
+                print(f"DEBUG [TCP]: {c.addr[0]} too slow for media, closing")
+                metrics.inc("tcp_slow_drop")
+                self.close(c)
+            elif not c.full_since: c.full_since = now; ok = False
+            elif time.ticks_diff(now, c.full_since) > MEDIA_STALL_MS: self.close(c)
+            else: ok = False
+        return ok
+
+    def received(self, c, n):
+        c.last_rx = time.ticks_ms()
+        c.bytes_rx += n
+
+    def pong(self, c):
+        c.hb_ok = True
+        c.rtt_ms = time.ticks_diff(time.ticks_ms(), c.hb_sent)
+
+    def check_health(self):
+        # Heartbeats and dead-peer detection; returns True if a client was dropped
+        now, dropped = time.ticks_ms(), False
+        for i in range(len(self.clients) - 1, -1, -1):
+            c = self.clients[i]
+            idle = time.ticks_diff(now, c.last_rx)
+            if c.queue and time.ticks_diff(now, c.last_tx) > SEND_TIMEOUT_MS:
+                print(f"DEBUG [TCP]: Send timeout {c.addr[0]}")
+                self.dead_tx += 1
+            elif idle > (DEAD_PEER_MS if c.hb_ok else LEGACY_DEAD_MS):
+                print(f"DEBUG [TCP]: No heartbeat from {c.addr[0]}")
+                self.dead_rx += 1
+            else:
+                if idle > HEARTBEAT_MS and time.ticks_diff(now, c.hb_sent) > HEARTBEAT_MS:
+                    c.hb_sent = now
+                    self.publish(b"ping\n", SUB_EVENTS, c)
+                continue
+            self.close(c)
+            dropped = True
+        return dropped
+
+    def stats(self):
+        return {"clients": [{"ip": c.addr[0], "subs": c.subs, "rtt_ms": c.rtt_ms, "tx": c.bytes_tx, "rx": c.bytes_rx,
+                             "queued": c.queued, "dropped": c.dropped} for c in self.clients],
+                "connects": self.connects, "dead_rx": self.dead_rx, "dead_tx": self.dead_tx}
+
+    def pump(self):
+        for i in range(len(self.clients) - 1, -1, -1):
+            c = self.clients[i]
+            if c.queue and not c.flush(): self.close(c)
+
+    def _offer(self, c, mv, kind, held):
+        if kind != SUB_MEDIA and (c is self.raw_to or self.raw_open and c.subs & SUB_MEDIA):
+            if held is None: held = bytes(mv)
+            if not c.parked: c.parked_t = time.ticks_ms()
+            if len(c.parked) < MAX_PARKED: c.parked.append(held)
+            else: c.dropped += 1; metrics.inc("tcp_drop")
+            return held
+        sent = 0
+        if not c.queue:
+            sent = c.try_send(mv)
+            if sent < 0:
+                self.close(c)
+                return held
+            if sent == len(mv): return held
+        n = len(mv) - sent
+        if c.queued and c.queued + n > QUEUE_LIMIT:
+            if kind != SUB_MEDIA:
+                c.dropped += 1  # Events are superseded soon; never block for them
+                metrics.inc("tcp_drop")
+                return held
+            if not self._wait_room(c, n):
+                self.close(c)
+                return held
+        if held is None: held = bytes(mv)  # The single copy every queued client shares
+        if not c.queue: c.last_tx = time.ticks_ms()
+        c.queue.append(memoryview(held)[sent:])
+        c.queued += n
+        return held
+
+    def _wait_room(self, c, n):
+        start = time.ticks_ms()
+        while c.queued + n > QUEUE_LIMIT:
+            if time.ticks_diff(time.ticks_ms(), start) > MEDIA_STALL_MS: return False
+            self.pump()  # Keep every client moving while this one catches up
+            if c not in self.clients: return False
+            time.sleep_ms(1)
+        return True
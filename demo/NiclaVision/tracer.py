@@ -0,0 +1,58 @@
+import time
+import json
+from array import array
+
+# Tracepoints in a fixed ring: time.ticks_us stamp, point ID, phase and one int argument.
+# Writing never allocates, so points are safe in the audio callback. Oldest entries are
+# overwritten; dump_lines() streams the ring as JSON lines for demo/host/trace_to_chrome.py.
+SIZE = 512
+DUMP_BATCH = 48             # Events per JSON line
+TICKS_PERIOD = 1 << 30      # time.ticks_us wraps here on this port
+
+NAMES = ("snapshot", "predict", "decode", "send_tcp", "gc", "audio_cb", "job", "tof")
+SNAPSHOT, PREDICT, DECODE, SEND_TCP, GC, AUDIO_CB, JOB, TOF = range(len(NAMES))
+BEGIN, END, MARK = 0, 1, 2
+
+_ts = array('I', bytes(4 * SIZE))
+_arg = array('i', bytes(4 * SIZE))
+_id = bytearray(SIZE)
+_ph = bytearray(SIZE)
+_n = 0
+enabled = True
+
+def point(tid, ph=MARK, arg=0):
+    global _n
+    if not enabled: return
+    i = _n % SIZE
+    _ts[i] = time.ticks_us()
+    _id[i] = tid
+    _ph[i] = ph
+    _arg[i] = arg
+    _n += 1
+
+def begin(tid, arg=0): point(tid, BEGIN, arg)
+
+def end(tid, arg=0): point(tid, END, arg)
+
+def dump_lines():
+    # Generator of JSON lines; recording pauses until it is exhausted or closed
+    global enabled
+    was, enabled = enabled, False
+    try:
+        count = min(_n, SIZE)
+        first = _n - count
+        yield ('{"type":"trace","names":%s,"period":%d,"count":%d}\n' % (json.dumps(NAMES), TICKS_PERIOD, count)).encode()
+        k = 0
+        while k < count:
+            parts = []
+            for j in range(k, min(k + DUMP_BATCH, count)):
+                i = (first + j) % SIZE
+                parts.append("[%d,%d,%d,%d]" % (_ts[i], _id[i], _ph[i], _arg[i]))
+            yield ('{"type":"trace_ev","ev":[' + ",".join(parts) + "]}\n").encode()
+            k += DUMP_BATCH
+        yield b'{"type":"trace_end"}\n'
+    finally: enabled = was
+
+def clear():
+    global _n
+    _n = 0
@@ -0,0 +1,152 @@
+import time
+from binascii import crc32
+
+# Sequenced transfer framing (one text line per chunk, payload follows):
+#   XFER_START:<id>,<kind>,<size>,<crc32>,<chunk>[,<extra>...][ #<request id>]
+#   XFER_CHUNK:<id>,<seq>,<offset>,<len>,<crc32>   + <len> bytes
+#   XFER_END:<id>
+# The app answers ACK:<id>,<offset> (bytes received in order) and, after a dropped
+# link, RESUME:<id>[,<offset>] to continue from there instead of re-capturing.
+CHUNK_SIZE = 2048
+HOLD_MS = 60000
+KEEP_PER_KIND = 3           # Unacknowledged objects held per kind; the least recently used goes first
+
+class Outbox:
+    def __init__(self, send, chunk=CHUNK_SIZE, hold_ms=HOLD_MS, ready=None):
+        self.send = send          # send(bytes) -> bool, False once the link is gone
+        self.ready = ready        # ready(n) -> bool, False while n more bytes would block; None = always
+        self.chunk = chunk
+        self.hold_ms = hold_ms
+        self.buf = bytearray(chunk)
+        self.pending = {}         # id -> [kind, segments, size, crc, acked, touched, keep]
+        self.active = []          # [id, offset, send, start line] streams still going out, one chunk per service()
+        self.next_id = 1
+
+    def start(self, kind, segments, keep=None, rid=None, extra=None):
+        # Segments stay referenced (no copy) until acknowledged or expired
+        size, crc = 0, 0
+        for seg in segments:
+            size += len(seg)
+            crc = crc32(seg, crc)
+        tid = self.next_id
+        self.next_id = (tid % 0xFFFF) + 1
+        self._evict(kind)  # Owners whose buffers get reused call drop() themselves
+        self.pending[tid] = [kind, segments, size, crc, 0, time.ticks_ms(), keep]
+        line = "XFER_START:%d,%s,%d,%d,%d" % (tid, kind, size, crc, self.chunk)
+        if extra: line += "," + extra  # Capture metadata, after the fields older parsers read
+        # XFER_START goes out from service() too, so it waits for room like the chunks
+        self.active.append([tid, 0, self.send, (line + (" #" + rid if rid else "") + "\n").encode()])  # Echo the capture's request ID
+        return tid
+
+    def ack(self, tid, offset):
+        p = self.pending.get(tid)
+        if not p or not 0 <= offset <= p[2]: return  # Unknown, or an offset this object cannot have
+        if offset == p[2]: del self.pending[tid]
+        else: p[4] = max(p[4], offset); p[5] = time.ticks_ms()
+
+    def resume(self, tid, offset=None, send=None):
+        send = send or self.send
+        p = self.pending.get(tid)
+        if not p:
+            send(("XFER_GONE:%d\n" % tid).encode())
+            return False
+        if offset is None: offset = p[4]
+        if not 0 <= offset <= p[2]: return False  # Malformed; a stream from there would slice out of bounds
+        p[5] = time.ticks_ms()
+        self.active.append([tid, offset - offset % self.chunk, send, None])
+        return True
+
+    def cancel(self, tid):
+        # Withdraw one transfer between chunks; the app learns it will not complete
+        if tid not in self.pending: return False
+        del self.pending[tid]
+        self.active = [a for a in self.active if a[0] in self.pending]
+        self.send(("XFER_GONE:%d\n" % tid).encode())
+        return True
+
+    def drop(self, kind):
+        # Forget held objects of one kind, e.g. before their buffers get reused
+        for k in [k for k, p in self.pending.items() if p[0] == kind]: del self.pending[k]
+        self.active = [a for a in self.active if a[0] in self.pending]
+
+    def _evict(self, kind):
+        # Make room for one more of kind within KEEP_PER_KIND
+        while True:
+            ks = [k for k, p in self.pending.items() if p[0] == kind]
+            if len(ks) < KEEP_PER_KIND: break
+            now = time.ticks_ms()
+            del self.pending[max(ks, key=lambda k: time.ticks_diff(now, self.pending[k][5]))]
+        self.active = [a for a in self.active if a[0] in self.pending]
+
+    def busy(self):
+        return bool(self.active)
+
+    def service(self):
+        # Send one chunk of the oldest active stream; True while more remain.
+        # With ready= set, nothing is sent until the link has room, so a call never blocks.
+        if not self.active: return False
+        a = self.active[0]
+        tid, offset, send, first = a
+        if tid not in self.pending:
+            self.active.pop(0)
+            return bool(self.active)
+        if first:
+            if self.ready and not self.ready(len(first)): return True
+            a[3] = None
+            if send(first): return True
+            self.active.pop(0)
+            return bool(self.active)
+        segments, size = self.pending[tid][1:3]
+        if offset < size:
+            n = min(self.chunk, size - offset)
+            if self.ready and not self.ready(n + 48): return True  # Chunk plus its header line
+            mv = memoryview(self.buf)
+            n = self._read(segments, offset, self.buf)
+            hdr = "XFER_CHUNK:%d,%d,%d,%d,%d\n" % (tid, offset // self.chunk, offset, n, crc32(mv[:n]))
+            if send(hdr.encode()) and send(mv[:n]):
+                a[1] = offset + n
+                return True
+        else:
+            if self.ready and not self.ready(16): return True
+            send(("XFER_END:%d\n" % tid).encode())
+        self.active.pop(0)  # Finished, or the link went away: wait for RESUME
+        return bool(self.active)
+
+    def flush(self):
+        while self.service(): pass
+
+    def expire(self):
+        if not self.pending: return
+        now = time.ticks_ms()
+        for k in [k for k, p in self.pending.items() if time.ticks_diff(now, p[5]) > self.hold_ms]:
+            print(f"DEBUG [Xfer]: {k} expired")
+            del self.pending[k]
+
+    def handle(self, cmd, send=None):
+        # ACK:<id>,<offset> / RESUME:<id>[,<offset>]; True if the command was ours.
+        # send= routes a resumed stream to the requester only
+        try:
+            if cmd.startswith("ACK:"):
+                a = cmd[4:].split(',')
+                self.ack(int(a[0]), int(a[1]))
+            elif cmd.startswith("RESUME:"):
+                a = cmd[7:].split(',')
+                self.resume(int(a[0]), int(a[1]) if len(a) > 1 else None, send)
+            else: return False
+        except (ValueError, IndexError): pass  # Malformed: consumed, not acted on
+        return True
+
+    def _read(self, segments, offset, buf):
+        # Gather up to len(buf) bytes starting at offset across segment boundaries
+        n, want = 0, len(buf)
+        for seg in segments:
+            l = len(seg)
+            if offset >= l:
+                offset -= l
+                continue
+            amt = min(l - offset, want - n)
+            buf[n:n+amt] = memoryview(seg)[offset:offset+amt]
+            n += amt
+            offset = 0
+            if n == want: break
+        return n
@@ -0,0 +1,68 @@
+import socket
+import time
+import metrics
+from event_codec import put, put_int
+
+# Unicast datagrams for time-critical events; TCP keeps commands and bulk payloads.
+# Each datagram is the event JSON with a "seq" field added. Critical events are sent
+# again after RESEND_MS with the same seq, unless newer state for the same key
+# (e.g. "collision") replaced them first. The app keeps the highest seq per key.
+RESEND_MS = (15, 40)
+DGRAM_SIZE = 160
+
+class EventChannel:
+    def __init__(self, hub):
+        self.hub = hub          # Peers are hub clients with udp_port set
+        self.sock = None
+        self.seq = 0
+        self.pending = {}       # key -> [datagram, t_first, next resend index]
+        self.sent = 0
+        self.dgram = bytearray(DGRAM_SIZE)   # Datagrams are built here; only critical ones are copied
+        mv = memoryview(self.dgram)
+        self.views = [mv[:n] for n in range(DGRAM_SIZE + 1)]
+
+    def open(self):
+        if self.sock: return
+        self.sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+        self.sock.setblocking(False)
+
+    def active(self):
+        for c in self.hub.clients:
+            if c.udp_port: return True
+        return False
+
+    def publish(self, key, msg, critical=False):
+        # msg is a JSON object (bytes or memoryview); returns False if nobody listens on UDP
+        if not self.sock or not self.active():
+            self.pending.clear()
+            return False
+        self.seq += 1
+        if len(msg) + 16 > DGRAM_SIZE: data = ('{"seq":%d,' % self.seq).encode() + bytes(msg[1:])
+        else:
+            b = self.dgram
+            i = put_int(b, put(b, 0, b'{"seq":', 0), self.seq)
+            b[i] = 44
+            data = self.views[put(b, i + 1, msg, 1)]
+        self._send(data)
+        if critical: self.pending[key] = [bytes(data), time.ticks_ms(), 0]
+        elif key in self.pending: del self.pending[key]  # Latest state wins
+        return True
+
+    def service(self):
+        if not self.pending: return
+        now = time.ticks_ms()
+        for key in list(self.pending):
+            p = self.pending[key]
+            if time.ticks_diff(now, p[1]) >= RESEND_MS[p[2]]:
+                self._send(p[0])
+                p[2] += 1
+                if p[2] >= len(RESEND_MS): del self.pending[key]
+
+    def _send(self, data):
+        for c in self.hub.clients:
+            if not c.udp_port: continue
+            try:
+                self.sock.sendto(data, c.udp_addr)
+                self.sent += 1
+                metrics.inc("udp_tx")
+            except OSError: pass
@@ -1,28 +1,144 @@
 import sensor
 import image
 import ml
-import gc
 import json
 import time
+import metrics
+import memory
 
 LABELS = ["face", "bottle"]
 
+# 4:3 frame sizes the sensor scales to in hardware, smallest first. Detection uses the
+# smallest one covering the model input, centre-windowed to the input's aspect, so
+# predict() only has a small (or no) resize left. Stills keep the full QVGA frame.
+_FRAMESIZES = (("QQQVGA", 80, 60), ("QQVGA", 160, 120), ("QVGA", 320, 240), ("VGA", 640, 480))
+LEGACY_MODE = (sensor.RGB565, sensor.QVGA, (240, 240))
+STILL_MODE = (sensor.RGB565, sensor.QVGA, None)
+DOC_SIZES = ("UXGA", "SXGA", "XGA", "SVGA", "VGA", "QVGA")  # Document mode candidates, largest first
+PAGE_MIN_AREA = 0.2         # A page rectangle must cover this much of the frame to be cropped to
+
 g_model = None
+_doc_mode = None
 
-def init_camera():
+def init_camera(settle_ms=2000):
+    # settle_ms=0 leaves auto exposure settling to the caller, e.g. a staged boot
     try:
         sensor.reset()
         # Ensure this matches your training: RGB565 and 240x240
         sensor.set_pixformat(sensor.RGB565)
         sensor.set_framesize(sensor.QVGA)
         sensor.set_windowing((240, 240))
-        sensor.skip_frames(time=2000)
+        if settle_ms: sensor.skip_frames(time=settle_ms)
         print("Camera Init OK (RGB 240x240)")
         return True
     except Exception as e:
         print(f"Cam Init Err: {e}")
         return False
 
+def model_input(model):
+    # (width, height, channels) from the model's NHWC input shape
+    shape = model.input_shape[0]
+    return shape[2], shape[1], shape[3] if len(shape) > 3 else 1
+
+def detect_mode(w, h, c):
+    name, fw, fh = _FRAMESIZES[-1]
+    for n, sw, sh in _FRAMESIZES:
+        if sw >= w and sh >= h and hasattr(sensor, n):
+            name, fw, fh = n, sw, sh
+            break
+    # Largest centred window with the input's aspect ratio, so the field of view matches the old 240x240 crop
+    k = min(fw * 1000 // w, fh * 1000 // h)
+    return (sensor.GRAYSCALE if c == 1 else sensor.RGB565, getattr(sensor, name), (w * k // 1000, h * k // 1000))
+
+def sharpness(img, scale=0.25):
+    # Laplacian variance on a small grayscale copy; higher is sharper
+    small = img.to_grayscale(x_scale=scale, y_scale=scale, copy=True)
+    small.laplacian(1)
+    return int(small.get_statistics().stdev() ** 2)
+
+def doc_mode():
+    # Largest grayscale frame the frame buffer takes, found once by trial
+    global _doc_mode
+    if _doc_mode: return _doc_mode
+    for name in DOC_SIZES:
+        if not hasattr(sensor, name): continue
+        mode = (sensor.GRAYSCALE, getattr(sensor, name), None)
+        try:
+            set_mode(mode)
+            img = sensor.snapshot()
+        except Exception: continue  # Frame buffer overflow
+        print(f"DEBUG [Cam]: Document mode {name} {img.width()}x{img.height()}")
+        _doc_mode = mode
+        return mode
+    return (sensor.GRAYSCALE, sensor.QVGA, None)
+
+def page_rect(img, scale=4):
+    # Bounding box of the largest rectangle found on a 1/scale copy, or None
+    small = img.copy(x_scale=1 / scale, y_scale=1 / scale)
+    best, area = None, small.width() * small.height() * PAGE_MIN_AREA
+    for r in small.find_rects(threshold=10000):
+        x, y, w, h = r.rect()
+        if w * h > area: best, area = (x, y, w, h), w * h
+    if best is None: return None
+    x, y, w, h = best
+    x, y = max(0, x * scale - scale), max(0, y * scale - scale)  # One small pixel of margin
+    return x, y, min(img.width() - x, w * scale + 2 * scale), min(img.height() - y, h * scale + 2 * scale)
+
+def document(img, crop=False):
+    # In place: optional crop to the page, then histogram equalisation so faint print gets full contrast
+    roi = page_rect(img) if crop else None
+    if roi: img.crop(roi=roi)
+    img.histeq()
+    return roi
+
+def _frame_dims(size):
+    for n, w, h in _FRAMESIZES:
+        if getattr(sensor, n, None) == size: return w, h
+    return 320, 240
+
+def cell_roi(mode, cell, grid, img_w, img_h, pad=1):
+    # Heatmap cell seen in `mode` (centre-windowed) -> (x, y, w, h) in a full frame of img_w x img_h,
+    # grown by `pad` cells on each side
+    fw, fh = _frame_dims(mode[1])
+    ww, wh = mode[2] or (fw, fh)
+    # Window origin and cell size, in thousandths of the full frame
+    ox, oy = (fw - ww) * 500 // fw, (fh - wh) * 500 // fh
+    cw, ch = ww * 1000 // (fw * grid[0]), wh * 1000 // (fh * grid[1])
+    x0 = max(0, (ox + (cell[0] - pad) * cw) * img_w // 1000)
+    y0 = max(0, (oy + (cell[1] - pad) * ch) * img_h // 1000)
+    x1 = min(img_w, (ox + (cell[0] + 1 + pad) * cw) * img_w // 1000)
+    y1 = min(img_h, (oy + (cell[1] + 1 + pad) * ch) * img_h // 1000)
+    return x0, y0, x1 - x0, y1 - y0
+
+def set_mode(mode, settle_frames=0):
+    pix, size, win = mode
+    sensor.set_pixformat(pix)
+    sensor.set_framesize(size)
+    if win: sensor.set_windowing(win)
+    if settle_frames: sensor.skip_frames(n=settle_frames)
+
+def benchmark(model, modes, frames=20):
+    # Generator (one frame per step) timing snapshot and predict, which includes the
+    # resize/convert to the model input, per camera mode; returns a dict per mode
+    results = []
+    inp = [None]
+    for mode in modes:
+        set_mode(mode, 3)
+        snap = pred = 0
+        for _ in range(frames):
+            t0 = time.ticks_us()
+            img = sensor.snapshot()
+            t1 = time.ticks_us()
+            inp[0] = img
+            model.predict(inp)
+            snap += time.ticks_diff(t1, t0)
+            pred += time.ticks_diff(time.ticks_us(), t1)
+            yield
+        results.append({"frame": "%dx%d" % (img.width(), img.height()), "bytes": img.size(),
+                        "gray": mode[0] == sensor.GRAYSCALE, "snap_us": snap // frames, "predict_us": pred // frames})
+        img = None
+    return results
+
 def load_model():
     global g_model
     if g_model is None:
@@ -35,7 +151,6 @@ def load_model():
     return True
 
 def capture_image(filename="temp.jpg"):
-    gc.collect()
     try:
         sensor.set_windowing((320, 240))
         sensor.skip_frames(time=100)
@@ -56,8 +171,8 @@ def capture_image(filename="temp.jpg"):
         return False
 
 def run_detection():
+    # Per-frame path: no collections here, the caller's idle slots take care of it
     global g_model
-    gc.collect()
 
     try:
         if not load_model():
@@ -67,9 +182,14 @@ def run_detection():
 
         sensor.set_windowing((240, 240))
 
+        t0 = time.ticks_ms()
         img = sensor.snapshot()
+        metrics.since("snap_ms", t0)
 
+        t0 = time.ticks_ms()
         result = g_model.predict([img])[0].flatten().tolist()
+        metrics.since("predict_ms", t0)
+        metrics.inc("frames")
 
         best_index = max(range(len(result)), key=lambda i: result[i])
         best_conf = result[best_index]
@@ -77,7 +197,6 @@ def run_detection():
         label_name = LABELS[best_index] if best_index < len(LABELS) else "Unknown"
 
         del img
-        gc.collect()
 
         if best_conf >= THRESHOLD:
             return json.dumps({
@@ -91,5 +210,5 @@ def run_detection():
             })
 
     except Exception as e:
-        gc.collect()
+        memory.request()
         return json.dumps({"label": "Error", "conf": str(e)})
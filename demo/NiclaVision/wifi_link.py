@@ -0,0 +1,141 @@
+import network
+import time
+import json
+import binascii
+import uos
+
+CACHE_FILE = "wifi_cache.json"
+ASSOC_TIMEOUT_MS = 10000
+BACKOFF_MS = 500
+BACKOFF_MAX_MS = 16000
+FIRST_ATTEMPTS = 3          # Credentials that never worked go back to provisioning after this
+GIVE_UP_MS = 300000         # A link that did work is retried this long before provisioning
+SCAN_DELAY_MS = 5000        # The one BSSID scan per network waits this long after the join, then for idle()
+
+DOWN, CONNECTING, BACKOFF, UP, FAILED = 0, 1, 2, 3, 4
+
+_FAIL_STATUS = tuple(getattr(network, n) for n in ("STAT_WRONG_PASSWORD", "STAT_NO_AP_FOUND", "STAT_CONNECT_FAIL") if hasattr(network, n))
+
+class WifiLink:
+    # Non-blocking association: start() kicks it off, service() is called every loop pass,
+    # and idle() when a blocking scan would not hold anyone up.
+    # The last good BSSID/channel/IP config is cached so a reconnect skips the scan and DHCP.
+    def __init__(self, led=None):
+        self.wlan = network.WLAN(network.STA_IF)
+        self.led = led
+        self.state = DOWN
+        self.ssid, self.key = "", ""
+        self.cache = self._load_cache()
+        self.ever_up = False
+        self.attempt = 0
+        self.t_down = 0
+        self.t_assoc = 0
+        self.t_retry = 0
+        self.connect_ms = 0     # Time from losing/starting the link to being up
+        self.reconnects = 0
+        self.scan_due = None    # ticks after which idle() may learn the AP's BSSID
+
+    def start(self, ssid, key):
+        self.ssid, self.key = ssid, key
+        self.ever_up = False
+        self.attempt = 0
+        self.t_down = time.ticks_ms()
+        self._associate()
+
+    def service(self):
+        now = time.ticks_ms()
+        if self.state == CONNECTING:
+            if self.wlan.isconnected(): self._up(now)
+            elif self.wlan.status() in _FAIL_STATUS or time.ticks_diff(now, self.t_assoc) > ASSOC_TIMEOUT_MS: self._retry(now)
+            elif self.led: self.led.on() if (now >> 7) & 7 == 0 else self.led.off()
+        elif self.state == BACKOFF:
+            if time.ticks_diff(now, self.t_retry) >= 0: self._associate()
+        elif self.state == UP and not self.wlan.isconnected():
+            # Short drops are re-joined in place; sockets and clients are left alone
+            print("DEBUG [WiFi]: Link lost, rejoining")
+            self.t_down = now
+            self.attempt = 0
+            self._associate()
+        return self.state
+
+    def _cached(self):
+        c = self.cache
+        return c if c and c.get("ssid") == self.ssid else None
+
+    def _associate(self):
+        self.wlan.active(True)
+        c = self._cached() if self.attempt < 2 else None  # Cached AP gone: fall back to a full scan/DHCP
+        try:
+            if c and self.ever_up and c.get("ip"): self.wlan.ifconfig(tuple(c["ip"]))
+            else: self.wlan.ifconfig('dhcp')
+        except Exception: pass
+        try:
+            if c and c.get("bssid"): self.wlan.connect(self.ssid, self.key, bssid=binascii.unhexlify(c["bssid"]))
+            else: self.wlan.connect(self.ssid, self.key)
+        except Exception:
+            self.wlan.connect(self.ssid, self.key)
+        self.state = CONNECTING
+        self.t_assoc = time.ticks_ms()
+
+    def _up(self, now):
+        self.connect_ms = time.ticks_diff(now, self.t_down)
+        if self.ever_up: self.reconnects += 1
+        print(f"DEBUG [WiFi]: Up in {self.connect_ms} ms (attempt {self.attempt + 1}, {'reconnect' if self.ever_up else 'join'})")
+        self.ever_up = True
+        self.state = UP
+        self.attempt = 0
+        if self.led: self.led.off()
+        self._save_cache()
+
+    def _retry(self, now):
+        self.attempt += 1
+        try: self.wlan.disconnect()
+        except Exception: pass
+        if (not self.ever_up and self.attempt >= FIRST_ATTEMPTS) or (self.ever_up and time.ticks_diff(now, self.t_down) > GIVE_UP_MS):
+            print("DEBUG [WiFi]: Giving up")
+            self.state = FAILED
+            if self.led: self.led.off()
+            return
+        delay = min(BACKOFF_MS << (self.attempt - 1), BACKOFF_MAX_MS)
+        print(f"DEBUG [WiFi]: Attempt {self.attempt} failed, retry in {delay} ms")
+        self.state = BACKOFF
+        self.t_retry = time.ticks_add(now, delay)
+
+    def _save_cache(self):
+        c = self._cached() or {"ssid": self.ssid}
+        ip = list(self.wlan.ifconfig())
+        if c is self.cache and c.get("ip") == ip and c.get("bssid"): return  # Unchanged, spare the flash
+        c["ip"] = ip
+        if not c.get("bssid"): self.scan_due = time.ticks_add(time.ticks_ms(), SCAN_DELAY_MS)
+        self._write_cache(c)
+
+    def idle(self):
+        # The scan blocks for seconds, so it only runs when the owner has nothing else to do
+        if self.scan_due is None or self.state != UP or time.ticks_diff(time.ticks_ms(), self.scan_due) < 0: return
+        self.scan_due = None
+        c = self._cached()
+        if not c or c.get("bssid"): return
+        # One scan per network to learn the AP; later joins skip it
+        try:
+            best = None
+            for ssid, bssid, channel, rssi, _, _ in self.wlan.scan():
+                if ssid.decode() == self.ssid and (best is None or rssi > best[2]): best = (bssid, channel, rssi)
+            if best: c["bssid"], c["channel"] = binascii.hexlify(best[0]).decode(), best[1]
+        except Exception as e: print("DEBUG [WiFi]: Scan failed", e)
+        self._write_cache(c)
+
+    def _write_cache(self, c):
+        self.cache = c
+        try:
+            with open(CACHE_FILE, "w") as f: json.dump(c, f)
+        except Exception: pass
+
+    def _load_cache(self):
+        try:
+            with open(CACHE_FILE) as f: return json.load(f)
+        except Exception: return None
+
+    def forget(self):
+        self.cache = None
+        try: uos.remove(CACHE_FILE)
+        except Exception: pass
@@ -0,0 +1,299 @@
+"""Companion-app stand-in for load and latency tests of the glasses protocol.
+
+Does what AscentaService does: waits for NICLA_READY on UDP 5006 (or takes --host),
+connects to TCP 5005, answers heartbeat pings, parses JSON events and reads the raw
+IMG_START / THUMB_START / AUD_START / JOURNAL_START payloads. A workload is a comma
+separated list of command[*count] steps sent one after another, each waiting for its
+reply, and the run ends with latency percentiles and throughput per message type.
+
+    python app_emulator.py --script "ping*50,take_picture*10,RECORD*3"
+    python app_emulator.py --host 192.168.1.50 --script "take_picture_prog*5" --gap 0.5
+    python app_emulator.py --simulate --script "ping*100,take_picture*20"
+
+--simulate runs a minimal fake firmware on localhost so the client itself can be checked.
+"""
+import argparse
+import json
+import os
+import queue
+import random
+import socket
+import threading
+import time
+
+TCP_PORT = 5005
+UDP_DISC_PORT = 5006
+# Command -> raw header that completes it; commands not listed are answered by a JSON line or a pong
+REPLIES = {"take_picture": "IMG_START", "RECORD": "AUD_START", "RECORD_MEMO": "AUD_START",
+           "JOURNAL": "JOURNAL_START"}
+JSON_REPLIES = {"stats": "stats", "health": "health", "mem": "mem", "bench_cam": "bench_cam"}
+
+
+def percentile(values, p):
+    if not values:
+        return float("nan")
+    values = sorted(values)
+    return values[min(len(values) - 1, int(len(values) * p / 100))]
+
+
+def discover(timeout):
+    udp = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+    udp.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+    udp.bind(("", UDP_DISC_PORT))
+    udp.settimeout(timeout)
+    try:
+        while True:
+            data, addr = udp.recvfrom(512)
+            if data.strip() == b"NICLA_READY":
+                return addr[0]
+    except socket.timeout:
+        raise SystemExit(f"no NICLA_READY within {timeout:.0f} s")
+    finally:
+        udp.close()
+
+
+def split_id(line):
+    k = line.rfind(" #")
+    return (line, None) if k < 0 else (line[:k], line[k + 2:])
+
+
+def expected(cmd):
+    # What marks the command as answered: ("raw", header), ("json", type), ("pong", None) or None
+    base = cmd.split(":")[0]
+    if base == "ping":
+        return "pong", None
+    if base.startswith("take_picture"):
+        return "raw", "IMG_START"
+    if base in REPLIES:
+        return "raw", REPLIES[base]
+    if cmd in JSON_REPLIES or base in JSON_REPLIES:
+        return "json", JSON_REPLIES.get(cmd, JSON_REPLIES.get(base))
+    return None
+
+
+class Client:
+    """One TCP connection: a reader thread that frames the stream and a request/reply matcher."""
+
+    def __init__(self, host, port, timeout):
+        self.sock = socket.create_connection((host, port), timeout=timeout)
+        self.sock.settimeout(None)
+        self.lock = threading.Lock()
+        self.waiting = {}       # request id -> [kind, key, queue]
+        self.events = {}        # JSON type -> count
+        self.raw = {}           # header -> [count, bytes, seconds spent reading payloads]
+        self.first_seen = {}    # request id -> arrival of an early partial reply (a thumbnail)
+        self.closed = threading.Event()
+        threading.Thread(target=self._reader, daemon=True).start()
+
+    def request(self, cmd, rid, timeout):
+        # Send "cmd #rid" and wait for its reply; returns (first reply s, complete s) or None
+        want = expected(cmd)
+        q = queue.Queue()
+        if want:
+            with self.lock:
+                self.waiting[rid] = [want[0], want[1], q]
+        t = time.monotonic()
+        self.send(f"{cmd} #{rid}\n")
+        if not want:
+            return None
+        try:
+            done = q.get(timeout=timeout)
+        except queue.Empty:
+            with self.lock:
+                self.waiting.pop(rid, None)
+            return None
+        return self.first_seen.pop(rid, done) - t, done - t
+
+    def close(self):
+        try:
+            self.sock.shutdown(socket.SHUT_RDWR)
+        except OSError:
+            pass
+        self.sock.close()
+
+    def send(self, text):
+        with self.lock:
+            self.sock.sendall(text.encode())
+
+    def _match(self, kind, key, rid, now):
+        # By echoed request ID when the firmware has one, else the oldest request waiting for this reply
+        with self.lock:
+            if rid not in self.waiting:
+                rid = next((r for r, w in self.waiting.items() if w[0] == kind and w[1] == key), None)
+            w = self.waiting.get(rid) if rid else None
+            if not w or w[0] != kind or w[1] != key:
+                return
+            del self.waiting[rid]
+        w[2].put(now)
+
+    def _reader(self):
+        buf = b""
+        try:
+            while True:
+                while b"\n" not in buf:
+                    data = self.sock.recv(4096)
+                    if not data:
+                        return
+                    buf += data
+                line, buf = buf.split(b"\n", 1)
+                text, rid = split_id(line.decode(errors="replace").strip())
+                now = time.monotonic()
+                if text == "ping":
+                    self.send("pong\n")
+                elif text == "pong":
+                    self._match("pong", None, rid, now)
+                elif text.startswith("{"):
+                    try:
+                        msg = json.loads(text)
+                    except ValueError:
+                        continue
+                    kind = msg.get("type", "?")
+                    self.events[kind] = self.events.get(kind, 0) + 1
+                    self._match("json", kind, msg.get("req"), now)
+                elif "_START:" in text and not text.startswith("XFER"):
+                    head, fields = text.split(":", 1)
+                    size = int(fields.split(",")[0])
+                    if rid and head == "THUMB_START":
+                        self.first_seen.setdefault(rid, now)
+                    while len(buf) < size:
+                        data = self.sock.recv(65536)
+                        if not data:
+                            return
+                        buf += data
+                    buf = buf[size:]
+                    done = time.monotonic()
+                    r = self.raw.setdefault(head, [0, 0, 0.0])
+                    r[0], r[1], r[2] = r[0] + 1, r[1] + size, r[2] + done - now
+                    self._match("raw", head, rid, done)
+        except OSError:
+            pass
+        finally:
+            self.closed.set()
+
+
+def parse_script(script):
+    steps = []
+    for part in script.split(","):
+        part = part.strip()
+        if not part:
+            continue
+        cmd, _, count = part.partition("*")
+        steps += [cmd.strip()] * (int(count) if count else 1)
+    return steps
+
+
+def run(client, steps, gap, timeout):
+    lat = {}        # command -> [(first, complete)]
+    lost = {}
+    for n, cmd in enumerate(steps, 1):
+        if client.closed.is_set():
+            print("connection closed by the glasses")
+            break
+        r = client.request(cmd, str(n), timeout)
+        if r is not None:
+            lat.setdefault(cmd, []).append(r)
+        elif expected(cmd):
+            lost[cmd] = lost.get(cmd, 0) + 1
+        time.sleep(gap)
+    return lat, lost
+
+
+def report(client, lat, lost, elapsed):
+    print(f"\n{'command':<22}{'n':>5}{'lost':>6}{'p50 ms':>9}{'p95 ms':>9}{'max ms':>9}{'first p50':>11}")
+    for cmd, rs in sorted(lat.items()):
+        done = [r[1] * 1000 for r in rs]
+        first = [r[0] * 1000 for r in rs]
+        print(f"{cmd:<22}{len(rs):>5}{lost.get(cmd, 0):>6}{percentile(done, 50):>9.1f}{percentile(done, 95):>9.1f}"
+              f"{max(done):>9.1f}{percentile(first, 50):>11.1f}")
+    for cmd in sorted(set(lost) - set(lat)):
+        print(f"{cmd:<22}{0:>5}{lost[cmd]:>6}")
+    print(f"\n{'payload':<22}{'n':>5}{'KB':>10}{'KB/s read':>11}{'KB/s run':>10}")
+    for head, (n, size, secs) in sorted(client.raw.items()):
+        print(f"{head:<22}{n:>5}{size / 1024:>10.1f}{size / 1024 / max(secs, 1e-6):>11.1f}{size / 1024 / max(elapsed, 1e-6):>10.1f}")
+    if client.events:
+        print("\nJSON messages: " + ", ".join(f"{k}={v}" for k, v in sorted(client.events.items())))
+
+
+def simulator(port, ready):
+    # Just enough firmware to exercise the client: plain framing, request IDs and a det event now and then
+    srv = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+    srv.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+    srv.bind(("127.0.0.1", port))
+    srv.listen(1)
+    ready.set()
+    conn, _ = srv.accept()
+    buf, last_det = b"", time.monotonic()
+    conn.settimeout(0.05)
+    try:
+        while True:
+            try:
+                data = conn.recv(1024)
+                if not data:
+                    break
+                buf += data
+            except socket.timeout:
+                pass
+            if time.monotonic() - last_det > 0.5:
+                conn.sendall(b'{"type":"det","label":"bottle","dist":900,"pos":"left"}\n')
+                last_det = time.monotonic()
+            while b"\n" in buf:
+                line, buf = buf.split(b"\n", 1)
+                cmd, rid = split_id(line.decode().strip())
+                sfx = f" #{rid}" if rid else ""
+                if cmd == "ping":
+                    conn.sendall(f"pong{sfx}\n".encode())
+                elif cmd.startswith("take_picture"):
+                    time.sleep(0.03)  # Snapshot and encode
+                    if cmd == "take_picture_prog":
+                        conn.sendall(f"THUMB_START:3000,1{sfx}\n".encode() + os.urandom(3000))
+                    size = random.randint(8000, 14000)
+                    conn.sendall(f"IMG_START:{size}{sfx}\n".encode() + os.urandom(size))
+                elif cmd == "RECORD":
+                    time.sleep(0.2)  # Voice activity wait, much shorter than real
+                    conn.sendall(f"AUD_START:80044{sfx}\n".encode() + os.urandom(80044))
+                elif cmd in JSON_REPLIES:
+                    msg = {"type": JSON_REPLIES[cmd]}
+                    if rid:
+                        msg["req"] = rid
+                    conn.sendall((json.dumps(msg) + "\n").encode())
+    except OSError:
+        pass
+    finally:
+        conn.close()
+        srv.close()
+
+
+def main():
+    ap = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    ap.add_argument("--host", help="glasses address (default: wait for NICLA_READY)")
+    ap.add_argument("--port", type=int, default=TCP_PORT)
+    ap.add_argument("--script", default="ping*20,take_picture*5", help="command[*count],... sent in order")
+    ap.add_argument("--gap", type=float, default=0.1, help="seconds between a reply and the next command")
+    ap.add_argument("--timeout", type=float, default=15, help="seconds to wait for each reply")
+    ap.add_argument("--setup", default="", help="commands sent once before the workload, e.g. AUDIO_FMT:adpcm")
+    ap.add_argument("--simulate", action="store_true", help="run against a built-in fake on localhost")
+    args = ap.parse_args()
+
+    host = args.host
+    if args.simulate:
+        ready = threading.Event()
+        threading.Thread(target=simulator, args=(args.port, ready), daemon=True).start()
+        ready.wait()
+        host = "127.0.0.1"
+    elif not host:
+        host = discover(args.timeout * 4)
+        print(f"glasses at {host}")
+
+    client = Client(host, args.port, args.timeout)
+    for cmd in parse_script(args.setup):
+        client.send(cmd + "\n")
+    steps = parse_script(args.script)
+    t = time.monotonic()
+    lat, lost = run(client, steps, args.gap, args.timeout)
+    elapsed = time.monotonic() - t
+    client.close()
+    report(client, lat, lost, elapsed)
+
+
+if __name__ == "__main__":
+    main()
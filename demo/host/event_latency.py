@@ -0,0 +1,121 @@
+"""Loopback stand-in comparing event latency on the TCP stream and the UDP channel.
+
+A fake glasses thread streams JPEG-sized bulk data over TCP and, every EVENT_MS,
+emits a collision event both inline on TCP and as a datagram (with two redundant
+copies, as the firmware does for critical zones). The receiver reads TCP at a
+throttled rate to mimic a busy WiFi link and reports latency percentiles.
+
+    python event_latency.py [--seconds 10] [--link-kbps 800]
+"""
+import argparse
+import json
+import socket
+import threading
+import time
+
+TCP_PORT = 15005
+UDP_PORT = 15007
+EVENT_MS = 100
+BULK_CHUNK = 1024
+
+
+def percentile(values, p):
+    if not values:
+        return float("nan")
+    values = sorted(values)
+    return values[min(len(values) - 1, int(len(values) * p / 100))]
+
+
+def glasses(seconds, stop):
+    srv = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+    srv.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+    srv.bind(("127.0.0.1", TCP_PORT))
+    srv.listen(1)
+    conn, _ = srv.accept()
+    conn.setsockopt(socket.SOL_SOCKET, socket.SO_SNDBUF, 16384)
+    udp = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+    bulk = b"\xff" * BULK_CHUNK
+    seq, next_event, resends = 0, time.monotonic(), []
+    end = time.monotonic() + seconds
+    try:
+        while time.monotonic() < end and not stop.is_set():
+            now = time.monotonic()
+            if now >= next_event:
+                seq += 1
+                event = {"seq": seq, "type": "collision", "dist": 350, "zone": "critical", "t": time.monotonic()}
+                line = (json.dumps(event) + "\n").encode()
+                udp.sendto(line, ("127.0.0.1", UDP_PORT))
+                resends += [(now + 0.015, line), (now + 0.040, line)]
+                conn.sendall(b"EVT:" + line)
+                next_event += EVENT_MS / 1000
+            for item in [r for r in resends if r[0] <= now]:
+                udp.sendto(item[1], ("127.0.0.1", UDP_PORT))
+                resends.remove(item)
+            conn.sendall(bulk)
+    except OSError:
+        pass
+    finally:
+        conn.close()
+        srv.close()
+        udp.close()
+
+
+def main():
+    ap = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    ap.add_argument("--seconds", type=float, default=10)
+    ap.add_argument("--link-kbps", type=float, default=800, help="TCP read rate that stands in for the WiFi link")
+    args = ap.parse_args()
+
+    stop = threading.Event()
+    udp = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+    udp.bind(("127.0.0.1", UDP_PORT))
+    udp.settimeout(0.2)
+    udp_lat, seen = [], set()
+
+    def udp_reader():
+        while not stop.is_set():
+            try:
+                data, _ = udp.recvfrom(2048)
+            except socket.timeout:
+                continue
+            event = json.loads(data)
+            if event["seq"] in seen:
+                continue  # Redundant copy
+            seen.add(event["seq"])
+            udp_lat.append((time.monotonic() - event["t"]) * 1000)
+
+    t_glasses = threading.Thread(target=glasses, args=(args.seconds, stop), daemon=True)
+    t_glasses.start()
+    t_udp = threading.Thread(target=udp_reader, daemon=True)
+    t_udp.start()
+    time.sleep(0.2)
+
+    tcp = socket.create_connection(("127.0.0.1", TCP_PORT))
+    tcp.setsockopt(socket.SOL_SOCKET, socket.SO_RCVBUF, 16384)
+    tcp_lat, buf = [], b""
+    per_read = 1024
+    delay = per_read / (args.link_kbps * 1000 / 8)
+    while True:
+        data = tcp.recv(per_read)
+        if not data:
+            break
+        buf += data
+        while b"EVT:" in buf:
+            start = buf.index(b"EVT:")
+            end = buf.find(b"\n", start)
+            if end < 0:
+                break
+            event = json.loads(buf[start + 4:end])
+            tcp_lat.append((time.monotonic() - event["t"]) * 1000)
+            buf = buf[end + 1:]
+        buf = buf[-512:]
+        time.sleep(delay)
+    stop.set()
+    t_udp.join()
+
+    for name, lat in (("tcp", tcp_lat), ("udp", udp_lat)):
+        print(f"{name}: n={len(lat)} p50={percentile(lat, 50):.1f} ms p95={percentile(lat, 95):.1f} ms max={max(lat, default=float('nan')):.1f} ms")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,103 @@
+"""Convert a firmware trace dump to Chrome trace-event JSON (chrome://tracing, Perfetto).
+
+The dump is the JSON lines the glasses send for the "trace" command. Either fetch it
+live or convert lines saved earlier (other lines in the file are ignored):
+
+    python trace_to_chrome.py --host 192.168.1.50 -o trace.json
+    python trace_to_chrome.py dump.txt -o trace.json
+"""
+import argparse
+import json
+import socket
+import sys
+
+TCP_PORT = 5005
+PH = {0: "B", 1: "E", 2: "i"}
+TIDS = {"audio_cb": 2}  # Callback-context points get their own track; the rest is the main loop
+
+
+def fetch(host, port, timeout):
+    sock = socket.create_connection((host, port), timeout=timeout)
+    sock.sendall(b"SUB:events\ntrace\n")
+    lines, buf = [], b""
+    while True:
+        data = sock.recv(4096)
+        if not data:
+            break
+        buf += data
+        *done, buf = buf.split(b"\n")
+        for line in done:
+            if line == b"ping":
+                sock.sendall(b"pong\n")
+            elif line.startswith(b'{"type":"trace'):
+                lines.append(line.decode())
+        if lines and lines[-1].startswith('{"type":"trace_end"'):
+            break
+    sock.close()
+    return lines
+
+
+def convert(lines):
+    names, period, events = None, 1 << 30, []
+    for line in lines:
+        line = line.strip()
+        if not line.startswith("{"):
+            continue
+        msg = json.loads(line)
+        if msg.get("type") == "trace":
+            names, period = msg["names"], msg["period"]
+        elif msg.get("type") == "trace_ev":
+            events += msg["ev"]
+    if names is None:
+        sys.exit("no trace header in input")
+
+    # ticks_us wraps; unwrap against the previous stamp so the timeline is monotonic
+    out, base, last, open_spans = [], 0, None, {}
+    for ts, tid, ph, arg in events:
+        if last is not None and ts < last:
+            base += period
+        last = ts
+        name = names[tid] if tid < len(names) else str(tid)
+        ev = {"name": name, "ph": PH.get(ph, "i"), "ts": base + ts, "pid": 1, "tid": TIDS.get(name, 1)}
+        if ev["ph"] == "B":
+            open_spans[name] = open_spans.get(name, 0) + 1
+        elif ev["ph"] == "E":
+            if not open_spans.get(name):
+                continue  # Its begin was overwritten in the ring
+            open_spans[name] -= 1
+        if ev["ph"] == "i":
+            ev["s"] = "t"
+        if arg:
+            ev["args"] = {"arg": arg}
+        out.append(ev)
+    t0 = out[0]["ts"] if out else 0
+    for ev in out:
+        ev["ts"] -= t0
+    return {"traceEvents": out, "displayTimeUnit": "ms",
+            "otherData": {"source": "nicla", "events": len(out)}}
+
+
+def main():
+    ap = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    ap.add_argument("dump", nargs="?", help="saved dump lines (default: stdin unless --host)")
+    ap.add_argument("--host", help="fetch the dump from the glasses at this address")
+    ap.add_argument("--port", type=int, default=TCP_PORT)
+    ap.add_argument("--timeout", type=float, default=10)
+    ap.add_argument("-o", "--output", default="trace.json")
+    args = ap.parse_args()
+
+    if args.host:
+        lines = fetch(args.host, args.port, args.timeout)
+    elif args.dump:
+        with open(args.dump) as f:
+            lines = f.readlines()
+    else:
+        lines = sys.stdin.readlines()
+    trace = convert(lines)
+    with open(args.output, "w") as f:
+        json.dump(trace, f)
+    print(f"{len(trace['traceEvents'])} events -> {args.output}")
+
+
+if __name__ == "__main__":
+    main()